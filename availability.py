@@ -0,0 +1,225 @@
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from models import parse_slot_time
+from pagination import parse_date
+
+logger = logging.getLogger(__name__)
+
+# Occupancy lives in one counter document per day:
+#   {'_id': 'YYYY-MM-DD', 'slots': {'09:00': 2, '10:00': 1}}
+# so availability for a range is one _id range read of (days in range)
+# documents, and booking is a single conditional $inc.
+
+DEFAULT_CAPACITY = 1
+DEFAULT_SLOT_TIMES = ('08:00', '09:00', '10:00', '11:00', '13:00', '14:00', '15:00', '16:00')
+DEFAULT_WEEKDAYS = (0, 1, 2, 3, 4)  # Monday to Friday
+# Slot starts are the office's wall-clock date and time, stored naive; they
+# are compared with the current time in SLOT_TIMEZONE, not with UTC
+DEFAULT_TIMEZONE = 'UTC'
+# Statuses that hold a place in their slot; Rejected and Cancelled free it
+OCCUPYING_STATUSES = ('Pending', 'Approved', 'Completed')
+RESERVE_ATTEMPTS = 3
+
+_settings = {
+    'capacity': DEFAULT_CAPACITY,
+    'slot_times': DEFAULT_SLOT_TIMES,
+    'weekdays': DEFAULT_WEEKDAYS,
+    'timezone': timezone.utc,
+}
+
+def _parse_list(value, default):
+    if not value:
+        return default
+    return tuple(item.strip() for item in value.split(',') if item.strip())
+
+def _format_slot_time(slot_time):
+    return f'{slot_time[0]:02d}:{slot_time[1]:02d}'
+
+def _parse_slot_times(value):
+    """SLOT_TIMES entries as sorted HH:MM strings, the form bookings are matched in"""
+    times = set()
+    for item in _parse_list(value, DEFAULT_SLOT_TIMES):
+        slot_time = parse_slot_time(item)
+        if slot_time is None:
+            raise RuntimeError(f"SLOT_TIMES entry {item!r} is not a time such as 09:00 or 2:00 PM")
+        times.add(_format_slot_time(slot_time))
+    return tuple(sorted(times))
+
+def _parse_timezone(name):
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise RuntimeError(f"SLOT_TIMEZONE {name!r} is not a time zone such as Asia/Manila") from None
+
+def init_app(app):
+    """Read SLOT_CAPACITY / SLOT_TIMES / SLOT_WEEKDAYS / SLOT_TIMEZONE from the app config"""
+    _settings['capacity'] = max(1, int(app.config.get('SLOT_CAPACITY', DEFAULT_CAPACITY)))
+    _settings['slot_times'] = _parse_slot_times(app.config.get('SLOT_TIMES'))
+    _settings['weekdays'] = tuple(int(day) for day in _parse_list(app.config.get('SLOT_WEEKDAYS'), DEFAULT_WEEKDAYS))
+    _settings['timezone'] = _parse_timezone(app.config.get('SLOT_TIMEZONE') or DEFAULT_TIMEZONE)
+
+def local_now():
+    """Current wall-clock time in SLOT_TIMEZONE, naive like the stored slot starts"""
+    return datetime.now(_settings['timezone']).replace(tzinfo=None)
+
+def capacity():
+    return _settings['capacity']
+
+def occupies_slot(status):
+    """Whether an appointment with this status counts against its slot's capacity"""
+    return (status or 'Pending') in OCCUPYING_STATUSES
+
+def slot_key(slot_start):
+    """(day, time) occupancy key for a slot start, e.g. ('2026-03-02', '14:30')"""
+    return slot_start.strftime('%Y-%m-%d'), slot_start.strftime('%H:%M')
+
+def reserve(occupancy, slot_start):
+    """Take one place in a slot; False if it is already at capacity.
+
+    The filter only matches while the slot is below capacity. When the
+    day document exists but the slot is full, the upsert collides with
+    its _id and raises DuplicateKeyError, so the check and the increment
+    are one round trip. A collision can also mean two first bookings of
+    the same day raced to create the document; that case is retried.
+    """
+    day, time = slot_key(slot_start)
+    field = f'slots.{time}'
+    for _ in range(RESERVE_ATTEMPTS):
+        try:
+            occupancy.update_one(
+                {'_id': day, field: {'$not': {'$gte': _settings['capacity']}}},
+                {'$inc': {field: 1}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            document = occupancy.find_one({'_id': day}, {field: 1})
+            if document and document.get('slots', {}).get(time, 0) >= _settings['capacity']:
+                return False
+    logger.warning("⚠️ Gave up reserving %s %s after %s attempts", day, time, RESERVE_ATTEMPTS)
+    return False
+
+def release(occupancy, slot_start):
+    day, time = slot_key(slot_start)
+    field = f'slots.{time}'
+    occupancy.update_one({'_id': day, field: {'$gt': 0}}, {'$inc': {field: -1}})
+
+def add_bookings(occupancy, slot_starts):
+    """Count already-inserted appointments (e.g. bulk imports) without a capacity check"""
+    counts = Counter(slot_key(slot_start) for slot_start in slot_starts if slot_start)
+    if not counts:
+        return
+    operations = [
+        UpdateOne({'_id': day}, {'$inc': {f'slots.{time}': count}}, upsert=True)
+        for (day, time), count in counts.items()
+    ]
+    occupancy.bulk_write(operations, ordered=False)
+
+def bookable_slot_start(date_value, time_value, now=None):
+    """Slot start for a new booking; raises ValueError with a client-facing message
+    unless it is one of SLOT_TIMES on one of SLOT_WEEKDAYS and hasn't started yet"""
+    day = parse_date(date_value, 'date')
+    slot_time = parse_slot_time(time_value)
+    if slot_time is None:
+        raise ValueError('preferred_time must be a time such as 09:00 or 2:00 PM')
+    if day.weekday() not in _settings['weekdays']:
+        raise ValueError('Appointments are not offered on that day')
+    time = _format_slot_time(slot_time)
+    if time not in _settings['slot_times']:
+        raise ValueError(f'preferred_time must be one of {", ".join(_settings["slot_times"])}')
+    slot_start = day + timedelta(hours=slot_time[0], minutes=slot_time[1])
+    if slot_start < (now or local_now()):
+        raise ValueError('That time slot has already passed')
+    return slot_start
+
+def availability(occupancy, start, end, now=None):
+    """Capacity, booked and available counts for every slot of every day in [start, end].
+
+    Reads only the occupancy documents for the range. Days outside
+    SLOT_WEEKDAYS are listed only if they somehow hold bookings. Slots
+    that have already started keep their booked count but have nothing
+    available.
+    """
+    now = now or local_now()
+    booked_by_day = {
+        document['_id']: document.get('slots', {})
+        for document in occupancy.find({'_id': {'$gte': start.strftime('%Y-%m-%d'), '$lte': end.strftime('%Y-%m-%d')}})
+    }
+    slot_capacity = _settings['capacity']
+    days = []
+    day = start
+    while day <= end:
+        key = day.strftime('%Y-%m-%d')
+        booked = booked_by_day.get(key, {})
+        open_day = day.weekday() in _settings['weekdays']
+        if open_day or any(booked.values()):
+            times = sorted(set(_settings['slot_times'] if open_day else ()) | {time for time, count in booked.items() if count})
+            days.append({
+                'date': key,
+                'slots': [
+                    {
+                        'time': time,
+                        'capacity': slot_capacity,
+                        'booked': booked.get(time, 0),
+                        'available': 0 if _slot_start(day, time) < now else max(slot_capacity - booked.get(time, 0), 0)
+                    }
+                    for time in times
+                ]
+            })
+        day += timedelta(days=1)
+    return days
+
+def _slot_start(day, time):
+    hour, minute = time.split(':')
+    return day + timedelta(hours=int(hour), minutes=int(minute))
+
+def rebuild(appointments, occupancy, start=None, end=None):
+    """Recount occupancy from the appointments themselves.
+
+    The only code path that scans appointments: run it once after
+    deploying, after restoring data, or if counters are suspected to have
+    drifted; bookings made while it runs may be miscounted. start/end
+    (inclusive datetimes) limit it to a range of days. Returns the number
+    of day documents written.
+    """
+    slot_filter = {'$type': 'date'}
+    if start:
+        slot_filter['$gte'] = start
+    if end:
+        slot_filter['$lt'] = end + timedelta(days=1)
+    pipeline = [
+        {'$match': {
+            'slot_start': slot_filter,
+            # A missing or null status means Pending
+            'status': {'$in': list(OCCUPYING_STATUSES) + [None]}
+        }},
+        {'$group': {
+            '_id': {
+                'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$slot_start'}},
+                'time': {'$dateToString': {'format': '%H:%M', 'date': '$slot_start'}}
+            },
+            'count': {'$sum': 1}
+        }}
+    ]
+    slots_by_day = defaultdict(dict)
+    for row in appointments.aggregate(pipeline):
+        slots_by_day[row['_id']['day']][row['_id']['time']] = row['count']
+
+    # Days with no bookings left would otherwise keep their old counts
+    stale = {'$nin': list(slots_by_day)}
+    if start:
+        stale['$gte'] = start.strftime('%Y-%m-%d')
+    if end:
+        stale['$lte'] = end.strftime('%Y-%m-%d')
+    occupancy.delete_many({'_id': stale})
+    if slots_by_day:
+        occupancy.bulk_write([
+            ReplaceOne({'_id': day}, {'_id': day, 'slots': slots}, upsert=True)
+            for day, slots in slots_by_day.items()
+        ], ordered=False)
+    logger.info("✅ Rebuilt slot occupancy for %s days", len(slots_by_day))
+    return len(slots_by_day)
@@ -0,0 +1,72 @@
+"""Microbenchmarks for the model layer on large list responses.
+
+Times each step a list endpoint performs per row (decoding stored
+documents, building the API representation, JSON encoding) over N
+synthetic appointments and prints the best per-row cost of several runs.
+
+    python bench_models.py --rows 10000 --repeat 5
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+import bson
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+from models import Appointment, User
+
+def make_appointments(rows):
+    user_id = ObjectId()
+    started = datetime(2026, 1, 1, 8, 0)
+    documents = []
+    for index in range(rows):
+        created_at = started + timedelta(minutes=index)
+        documents.append({
+            '_id': ObjectId(),
+            'user_id': user_id,
+            'date': (started + timedelta(days=index % 60)).strftime('%Y-%m-%d'),
+            'preferred_time': f'{9 + index % 8:02d}:00',
+            'concern_type': 'Academic',
+            'status': Appointment.STATUSES[index % len(Appointment.STATUSES)],
+            'attended': bool(index % 2),
+            'created_at': created_at.isoformat(),
+            'formatted_created_at': created_at.strftime('%B %d, %Y at %I:%M %p'),
+        })
+    return documents
+
+def best_of(repeat, function):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    documents = make_appointments(args.rows)
+    raw_documents = [RawBSONDocument(bson.encode(document)) for document in documents]
+    appointments = [Appointment.from_dict(document) for document in documents]
+    user = User('bench', 'x', id_number='1', birthdate='2000-01-01')
+
+    cases = [
+        ('from_dict (dict)', lambda: [Appointment.from_dict(document) for document in documents]),
+        ('from_dict (raw BSON)', lambda: [Appointment.from_dict(document) for document in raw_documents]),
+        # Fresh instances each run so the lazily formatted date is not already cached
+        ('to_json (first call)', lambda: [Appointment.from_dict(document).to_json() for document in documents]),
+        ('to_json (cached date)', lambda: [appointment.to_json() for appointment in appointments]),
+        ('to_dict (storage)', lambda: [appointment.to_dict() for appointment in appointments]),
+        ('raw BSON -> JSON text', lambda: json.dumps([Appointment.from_dict(document).to_json() for document in raw_documents])),
+        ('User.to_json', lambda: [user.to_json() for _ in range(args.rows)]),
+    ]
+    print(f"{args.rows} rows, best of {args.repeat}")
+    for name, function in cases:
+        seconds = best_of(args.repeat, function)
+        print(f"{name:<24} {seconds * 1000:9.2f} ms total {seconds / args.rows * 1e6:8.2f} us/row")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = 30
+DEFAULT_MAX_ENTRIES = 64
+
+class VersionedCache:
+    """In-process LRU cache invalidated by a data-version counter.
+
+    Writers call bump() after changing the underlying data, which makes every
+    entry stale at once. The TTL is a backstop for writes this process did
+    not see, e.g. those made by other gunicorn workers.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = 0
+        self._bumped_at = None
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, ttl=None, max_entries=None):
+        with self._lock:
+            if ttl is not None:
+                self.ttl = ttl
+            if max_entries is not None:
+                self.max_entries = max_entries
+            self._entries.clear()
+
+    def bump(self):
+        with self._lock:
+            self._version += 1
+            self._bumped_at = time.monotonic()
+            self._entries.clear()
+
+    def seconds_since_bump(self):
+        """Seconds since this process last saw a write; infinite if it never has"""
+        bumped_at = self._bumped_at
+        return float('inf') if bumped_at is None else time.monotonic() - bumped_at
+
+    def get(self, key):
+        """Return (True, value) on a fresh hit, (False, None) otherwise"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                version, expires_at, value = entry
+                if version == self._version and expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value, version):
+        """Store value computed against `version`; dropped if a write happened meanwhile"""
+        with self._lock:
+            if version != self._version or self.max_entries <= 0:
+                return
+            self._entries[key] = (version, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        found, value = self.get(key)
+        if found:
+            return value
+        # Read the version before computing so a concurrent write invalidates this result
+        version = self._version
+        value = compute()
+        self.set(key, value, version)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {
+                'version': self._version,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+# Results of the /all-appointments listings
+appointments_cache = VersionedCache()
@@ -1,46 +1,364 @@
+import logging
+import os
+import threading
+import time
+from flask import g, has_request_context
 from flask_pymongo import PyMongo
-from bson import ObjectId
-from models import User, Appointment
+from bson import ObjectId, json_util
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import MongoClient, ASCENDING, DESCENDING, IndexModel, ReadPreference, ReturnDocument, UpdateOne
+from pymongo.read_preferences import SecondaryPreferred
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from models import User, Appointment, AppointmentNotFound, InvalidStatusTransition, SlotUnavailable
+import availability
+import diagnostics
+import stats
+import health
+from cache import appointments_cache
+from pagination import encode_cursor, keyset_filter, sort_spec, APPOINTMENT_SORT_KEYS
+
+logger = logging.getLogger(__name__)
 
 mongo = PyMongo()
 
+# Bump INDEX_VERSION whenever INDEXES changes so init_app reconciles the
+# indexes on the next startup. Every index we manage is prefixed with
+# MANAGED_INDEX_PREFIX; anything else on the collections is left alone.
+INDEX_VERSION = 3
+MANAGED_INDEX_PREFIX = 'tupt_'
+# Server error code for dropping an index that doesn't exist
+INDEX_NOT_FOUND = 27
+INDEXES = {
+    'users': [
+        IndexModel([('username', ASCENDING)], name='tupt_username_unique', unique=True),
+        # Partial so accounts created without an ID number don't collide on null
+        IndexModel(
+            [('id_number', ASCENDING)],
+            name='tupt_id_number_unique',
+            unique=True,
+            partialFilterExpression={'id_number': {'$type': ['string', 'number']}}
+        ),
+    ],
+    'appointments': [
+        # Keyset pagination: per-user history newest first, admin listing by slot
+        IndexModel(
+            [('user_id', ASCENDING), ('date', DESCENDING), ('preferred_time', DESCENDING), ('_id', DESCENDING)],
+            name='tupt_user_id_date_time'
+        ),
+        IndexModel(
+            [('date', ASCENDING), ('preferred_time', ASCENDING), ('_id', ASCENDING)],
+            name='tupt_date_time'
+        ),
+        IndexModel([('created_at', DESCENDING)], name='tupt_created_at'),
+        # Schedule ranges: slot_start bounds plus the status filter, both from index keys
+        IndexModel([('slot_start', ASCENDING), ('status', ASCENDING)], name='tupt_slot_start_status'),
+    ],
+}
+
+# Set once the migrate-ids command has converted every stored ID to ObjectId
+_schema_state = {'canonical_ids': False}
+
+# Process that created the current MongoClient; a client must never be used across fork()
+_client_state = {'pid': None}
+
+# Flask config key -> MongoClient keyword
+CLIENT_OPTIONS = {
+    'MONGO_MAX_POOL_SIZE': 'maxPoolSize',
+    'MONGO_MIN_POOL_SIZE': 'minPoolSize',
+    'MONGO_MAX_IDLE_TIME_MS': 'maxIdleTimeMS',
+    'MONGO_COMPRESSORS': 'compressors',
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': 'serverSelectionTimeoutMS',
+    'MONGO_SOCKET_TIMEOUT_MS': 'socketTimeoutMS',
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': 'waitQueueTimeoutMS',
+}
+
+def client_options(app):
+    """MongoClient keyword arguments from the MONGO_* pool settings that are set"""
+    options = {
+        keyword: app.config[key]
+        for key, keyword in CLIENT_OPTIONS.items()
+        if app.config.get(key) not in (None, '')
+    }
+    # Never connect at construction time; the first operation connects, after any fork
+    options['connect'] = False
+    return options
+
+# Read preference for analytical and list reads; point reads stay on the primary.
+# fresh_window: seconds after a write during which cached listings read the
+# primary, so a lagging secondary can't refill the cache with pre-write data.
+_read_routing = {'list': ReadPreference.PRIMARY, 'fresh_window': 0}
+
+def configure_read_routing(app):
+    """Send list reads to secondaries when MONGO_SECONDARY_READS is on.
+
+    maxStalenessSeconds bounds how far behind a secondary may be before the
+    driver stops picking it (the server minimum is 90 seconds).
+    """
+    if app.config.get('MONGO_SECONDARY_READS', True):
+        max_staleness = int(app.config.get('MONGO_MAX_STALENESS_SECONDS', 90))
+        _read_routing['list'] = SecondaryPreferred(max_staleness=max_staleness)
+        _read_routing['fresh_window'] = max_staleness
+    else:
+        _read_routing['list'] = ReadPreference.PRIMARY
+        _read_routing['fresh_window'] = 0
+
+def list_collection(name):
+    """Collection handle for dashboard listings, dumps and aggregations that may read slightly stale data"""
+    return mongo.db.get_collection(name, read_preference=_read_routing['list'])
+
+def _cached_listing_collection(name):
+    """Like list_collection, but on the primary while a secondary may not have caught up with our last write.
+
+    The listing cache is cleared by writes; a recompute served by a
+    secondary that is up to maxStalenessSeconds behind would otherwise
+    be cached under the new version and hide the write for a whole TTL.
+    """
+    if appointments_cache.seconds_since_bump() < _read_routing['fresh_window']:
+        return mongo.db.get_collection(name, read_preference=ReadPreference.PRIMARY)
+    return list_collection(name)
+
+# Documents stay undecoded BSON until a field is read, so they can be
+# hashed for ETags without paying for decoding
+RAW_DOCUMENTS = CodecOptions(document_class=RawBSONDocument)
+
+def raw_collection(name):
+    return mongo.db.get_collection(name, codec_options=RAW_DOCUMENTS)
+
+def causal_session():
+    """Session whose reads are guaranteed to observe its earlier writes, even on a secondary"""
+    return mongo.cx.start_session(causal_consistency=True)
+
 def init_app(app):
-    mongo.init_app(app)
+    mongo.init_app(app, **client_options(app))
+    _client_state['pid'] = os.getpid()
+    configure_read_routing(app)
+    availability.init_app(app)
+    appointments_cache.configure(
+        ttl=app.config.get('APPOINTMENTS_CACHE_TTL'),
+        max_entries=app.config.get('APPOINTMENTS_CACHE_SIZE')
+    )
+    diagnostics.init_app(app)
+    health.monitor.start(lambda: mongo.db, interval=app.config.get('HEALTH_CHECK_INTERVAL', health.DEFAULT_INTERVAL))
+    failed = ensure_indexes()
+    # Registration relies on the unique indexes to reject duplicates; don't serve without them
+    unique_failed = [name for name, model in failed if model.document.get('unique')]
+    if unique_failed:
+        raise RuntimeError(
+            f"Unique indexes could not be created: {', '.join(unique_failed)}. "
+            "Remove the duplicate users and restart."
+        )
+    load_schema_state()
 
-def test_connection():
-    try:
+def init_worker(app):
+    """Make the Mongo client safe to use in the current (possibly forked) process.
+
+    With gunicorn --preload the app, and therefore the client, is created in
+    the master. Each worker gets its own client, health monitor thread and
+    warmed connection pool here.
+    """
+    if _client_state['pid'] != os.getpid():
+        logger.info("🔁 Creating MongoClient for worker %s", os.getpid())
+        # Abandon the parent's client without closing it; its sockets belong to the parent
+        mongo.cx = MongoClient(app.config['MONGO_URI'], **client_options(app))
+        mongo.db = mongo.cx.get_default_database()
+        _client_state['pid'] = os.getpid()
+        health.monitor.after_fork()
+        health.monitor.start(lambda: mongo.db, interval=app.config.get('HEALTH_CHECK_INTERVAL', health.DEFAULT_INTERVAL))
+    warm_pool(app.config.get('MONGO_MIN_POOL_SIZE') or 1)
+
+def warm_pool(connections):
+    """Open `connections` pooled sockets up front so the first requests don't pay for the handshakes"""
+    def ping():
         mongo.db.command('ping')
-        return True
-    except Exception:
+    
+    started = time.perf_counter()
+    threads = [threading.Thread(target=ping) for _ in range(max(1, int(connections)))]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        logger.info("✅ Warmed %s Mongo connections in %.1f ms", len(threads), (time.perf_counter() - started) * 1000)
+    except Exception as e:
+        logger.warning("⚠️ Could not warm Mongo connection pool: %s", e)
+
+def load_schema_state():
+    meta = mongo.db.schema_meta.find_one({'_id': 'canonical_ids'})
+    _schema_state['canonical_ids'] = bool(meta and meta.get('enabled'))
+    logger.debug("🔍 Canonical ObjectId mode: %s", _schema_state['canonical_ids'])
+
+def set_canonical_ids(enabled):
+    """Record whether all user/appointment IDs are stored as ObjectId"""
+    mongo.db.schema_meta.update_one(
+        {'_id': 'canonical_ids'},
+        {'$set': {'enabled': bool(enabled)}},
+        upsert=True
+    )
+    _schema_state['canonical_ids'] = bool(enabled)
+
+def canonical_ids():
+    return _schema_state['canonical_ids']
+
+def id_candidates(raw_id):
+    """Every stored form an ID may take.
+
+    A valid ObjectId string may be stored as ObjectId or, for legacy
+    documents, as the plain string; once IDs are canonical only the
+    ObjectId form is possible.
+    """
+    if isinstance(raw_id, ObjectId):
+        return [raw_id] if canonical_ids() else [raw_id, str(raw_id)]
+    if raw_id and ObjectId.is_valid(raw_id):
+        object_id = ObjectId(raw_id)
+        return [object_id] if canonical_ids() else [object_id, str(raw_id)]
+    return [raw_id]
+
+def id_query(raw_id, field='_id'):
+    """Filter matching raw_id in a single round trip, whatever form it is stored in"""
+    candidates = id_candidates(raw_id)
+    if len(candidates) == 1:
+        return {field: candidates[0]}
+    return {field: {'$in': candidates}}
+
+# API field -> stored fields it is read from, where they differ (see fieldsets.py)
+APPOINTMENT_STORED_FIELDS = {
+    'formatted_created_at': ('formatted_created_at', 'created_at'),
+    # The user_id is needed to resolve rows that have no snapshot yet
+    'user_info': ('user_info', 'user_id'),
+}
+USER_STORED_FIELDS = {'user_id': ('_id',)}
+
+def field_projection(fields, stored=APPOINTMENT_STORED_FIELDS, required=()):
+    """Projection reading only the stored fields behind the requested API fields, plus `required`.
+
+    _id is left out unless something needs it, so a projection of index
+    keys alone can be answered from the index without fetching documents.
+    """
+    projection = {'_id': 0}
+    for field in fields:
+        for name in stored.get(field, (field,)):
+            projection[name] = 1
+    for name in required:
+        projection[name] = 1
+    return projection
+
+def _index_keys(collection, name):
+    for model in INDEXES[collection]:
+        if model.document['name'] == name:
+            return set(model.document['key'])
+    return set()
+
+def _log_coverage(collection, index_name, projection):
+    if projection and logger.isEnabledFor(logging.DEBUG):
+        read = {name for name, included in projection.items() if included}
+        if read <= _index_keys(collection, index_name):
+            logger.debug("🔍 Covered query on %s.%s: %s", collection, index_name, sorted(read))
+
+def _index_matches(existing, model):
+    """Check whether an existing index has the same key and options as the declared one"""
+    document = model.document
+    if list(existing.get('key', [])) != list(document['key'].items()):
         return False
+    for option in ('unique', 'sparse', 'partialFilterExpression', 'expireAfterSeconds'):
+        if existing.get(option) != document.get(option):
+            return False
+    return True
+
+def ensure_indexes(force=False):
+    """Create, update and drop managed indexes so they match INDEXES.
+
+    The applied version is stored in the schema_meta collection, so a
+    normal startup costs a single find_one once the indexes are in place.
+    Returns [('collection.index_name', IndexModel)] for the indexes that
+    could not be created; empty when everything is in place.
+    """
+    meta = mongo.db.schema_meta.find_one({'_id': 'indexes'})
+    if not force and meta and meta.get('version') == INDEX_VERSION:
+        logger.debug("✅ Indexes already at version %s", INDEX_VERSION)
+        return []
+
+    logger.info("🔍 Reconciling indexes to version %s", INDEX_VERSION)
+    failed = []
+    for collection_name, models in INDEXES.items():
+        collection = mongo.db[collection_name]
+        existing = collection.index_information()
+        declared = {model.document['name']: model for model in models}
+
+        # Drop managed indexes that are no longer declared or whose definition changed
+        for name, info in existing.items():
+            if not name.startswith(MANAGED_INDEX_PREFIX):
+                continue
+            if name not in declared or not _index_matches(info, declared[name]):
+                logger.info("🗑️ Dropping index %s.%s", collection_name, name)
+                try:
+                    collection.drop_index(name)
+                except OperationFailure as e:
+                    # Another worker reconciling at the same time dropped it first
+                    if e.code != INDEX_NOT_FOUND:
+                        raise
+                    logger.debug("✅ Index %s.%s was already dropped", collection_name, name)
+
+        existing = collection.index_information()
+        missing = [model for name, model in declared.items() if name not in existing]
+        for model in missing:
+            try:
+                collection.create_indexes([model])
+                logger.info("✅ Created index %s.%s", collection_name, model.document['name'])
+            except OperationFailure as e:
+                # Usually duplicate values blocking a unique index; the caller decides whether to go on
+                failed.append((f"{collection_name}.{model.document['name']}", model))
+                logger.error("❌ Could not create index %s.%s: %s", collection_name, model.document['name'], e)
+
+    if not failed:
+        mongo.db.schema_meta.update_one(
+            {'_id': 'indexes'},
+            {'$set': {'version': INDEX_VERSION}},
+            upsert=True
+        )
+    return failed
+
+def test_connection():
+    """Connection state as of the last background health check"""
+    return health.monitor.state()['ok'] is True
 
 def insert_user(user):
+    """Insert a user; raises DuplicateKeyError if the username or ID number is taken"""
     try:
-        print(f"🔍 Attempting to insert user: {user.username}")
+        logger.debug("🔍 Attempting to insert user: %s", user.username)
         user_dict = user.to_dict()
-        print(f"📝 User data to insert: {user_dict}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("📝 User data to insert: %s", {key: value for key, value in user_dict.items() if key != 'password_hash'})
         
-        # Check if database connection is working
-        try:
-            mongo.db.command('ping')
-            print("✅ Database connection is active")
-        except Exception as e:
-            print(f"❌ Database connection failed: {e}")
+        # Fail fast if the background health check says the database is down
+        if not health.monitor.is_healthy():
+            logger.error("❌ Database connection failed: %s", health.monitor.state()['last_error'])
             return None
         
-        # Check if users collection exists
-        collections = mongo.db.list_collection_names()
-        print(f"📁 Available collections: {collections}")
-        
         result = mongo.db.users.insert_one(user_dict)
-        print(f"✅ User inserted successfully with ID: {result.inserted_id}")
+        logger.info("✅ User inserted successfully with ID: %s", result.inserted_id)
+        appointments_cache.bump()
         return str(result.inserted_id)
+    except DuplicateKeyError:
+        # Let the caller map the violated unique index to a 409
+        logger.info("❌ Duplicate user: %s", user.username)
+        raise
     except Exception as e:
-        print(f"❌ Error inserting user: {e}")
-        import traceback
-        print(f"🔍 Stack trace: {traceback.format_exc()}")
+        logger.exception("❌ Error inserting user: %s", e)
         return None
 
+def duplicate_key_field(error):
+    """Return the field name behind a DuplicateKeyError (or a bulk writeError dict), if it can be determined"""
+    details = error if isinstance(error, dict) else (error.details or {})
+    key_pattern = details.get('keyPattern') or details.get('keyValue') or {}
+    if key_pattern:
+        return next(iter(key_pattern))
+    message = details.get('errmsg', str(error))
+    for field in ('username', 'id_number'):
+        if field in message:
+            return field
+    return None
+
 def find_user_by_username(username):
     try:
         user_data = mongo.db.users.find_one({'username': username})
@@ -48,185 +366,424 @@ def find_user_by_username(username):
             return User.from_dict(user_data)
         return None
     except Exception as e:
-        print(f"Error finding user by username: {e}")
+        logger.error("Error finding user by username: %s", e)
         return None
 
-def find_user_by_id_number(id_number):
+def update_password_hash(user_id, old_hash, new_hash):
+    """Swap in a rehashed password; a no-op if the hash changed since it was read"""
     try:
-        user_data = mongo.db.users.find_one({'id_number': id_number})
-        if user_data:
-            return User.from_dict(user_data)
-        return None
+        result = mongo.db.users.update_one(
+            {**id_query(user_id), 'password_hash': old_hash},
+            {'$set': {'password_hash': new_hash}}
+        )
+        if result.modified_count != 1:
+            logger.info("⚠️ Password hash for %s not updated: user missing or hash changed since it was read", user_id)
+            return False
+        return True
     except Exception as e:
-        print(f"Error finding user by ID number: {e}")
-        return None
+        logger.error("❌ Error updating password hash for %s: %s", user_id, e)
+        return False
 
-def find_user_by_id(user_id):
-    try:
-        print(f"🔍 Searching for user with ID: {user_id}")
-        
-        # Try both ObjectId and string lookup
-        if ObjectId.is_valid(user_id):
-            user_data = mongo.db.users.find_one({'_id': ObjectId(user_id)})
-            if user_data:
-                print(f"✅ User found using ObjectId: {user_data.get('username')}")
-                return User.from_dict(user_data)
-        
-        # If not found with ObjectId, try string lookup
-        user_data = mongo.db.users.find_one({'_id': user_id})
-        if user_data:
-            print(f"✅ User found using string ID: {user_data.get('username')}")
-            return User.from_dict(user_data)
-        else:
-            print(f"❌ No user found with ID: {user_id}")
-            return None
-    except Exception as e:
-        print(f"❌ Error finding user by ID: {e}")
-        return None
+def find_user_profile_document(user_id, fields=None):
+    """The user's document as raw BSON, without password_hash; None if not found.
+
+    fields (names from fieldsets.USER_FIELDS) limits it to what they need.
+    """
+    projection = field_projection(fields, USER_STORED_FIELDS) if fields else {'password_hash': 0}
+    document = raw_collection('users').find_one(id_query(user_id), projection)
+    if document is None:
+        logger.info("❌ No user found with ID: %s", user_id)
+        diagnostics.record_miss(mongo.db.users, 'find', user_id)
+    return document
+
+# The user fields copied onto each appointment as user_info, so listings need no join
+USER_SNAPSHOT_FIELDS = ('username', 'id_number')
+
+def user_snapshot(user_data):
+    return {field: user_data.get(field) for field in USER_SNAPSHOT_FIELDS}
+
+def _find_users_by_ids(user_ids, fields=(), collection=None):
+    """{str(_id): user document holding only `fields`} for the user_ids that exist, in one $in query.
+
+    Reads the primary unless another users collection handle is given.
+    """
+    candidates = [candidate for user_id in user_ids if user_id for candidate in id_candidates(str(user_id))]
+    if not candidates:
+        return {}
+    collection = mongo.db.users if collection is None else collection
+    found = collection.find({'_id': {'$in': candidates}}, dict.fromkeys(fields or ('_id',), 1))
+    return {str(user_data['_id']): user_data for user_data in found}
+
+def _user_snapshots(user_ids):
+    """{str(user_id): snapshot} for the users that exist, in one query"""
+    return {
+        user_id: user_snapshot(user_data)
+        for user_id, user_data in _find_users_by_ids(user_ids, USER_SNAPSHOT_FIELDS).items()
+    }
 
 def insert_appointment(appointment):
     try:
         appointment_dict = appointment.to_dict()
-        print(f"📝 Inserting appointment data: {appointment_dict}")
-        print(f"🔍 User ID type in appointment: {type(appointment_dict['user_id'])}")
+        # Rows whose user can't be found are left without a snapshot; listings resolve them at read time
+        snapshot = _user_snapshots([appointment.user_id]).get(str(appointment.user_id))
+        if snapshot:
+            appointment_dict['user_info'] = snapshot
+        logger.debug("📝 Inserting appointment for user %s on %s at %s", appointment_dict['user_id'], appointment_dict['date'], appointment_dict['preferred_time'])
+        logger.debug("🔍 User ID type in appointment: %s", type(appointment_dict['user_id']))
         
         result = mongo.db.appointments.insert_one(appointment_dict)
-        print(f"✅ Appointment inserted with ID: {result.inserted_id}")
+        logger.info("✅ Appointment inserted with ID: %s", result.inserted_id)
+        appointments_cache.bump()
+        _record_stats([(appointment.slot_start, stats.appointment_deltas(appointment_dict))])
         return str(result.inserted_id)
     except Exception as e:
-        print(f"❌ Error inserting appointment: {e}")
-        import traceback
-        print(f"🔍 Stack trace: {traceback.format_exc()}")
+        logger.exception("❌ Error inserting appointment: %s", e)
         return None
 
-def find_appointments_by_user_id(user_id):
+def book_appointment(appointment):
+    """Reserve the appointment's slot, then insert it.
+
+    Raises SlotUnavailable when the slot is at capacity; nothing is
+    written in that case. Returns the new ID, or None if the insert
+    failed (the reservation is given back).
+    """
+    occupies = availability.occupies_slot(appointment.status)
+    if occupies and not availability.reserve(mongo.db.slot_occupancy, appointment.slot_start):
+        logger.info("❌ Slot %s is fully booked", appointment.slot_start)
+        raise SlotUnavailable("This time slot is fully booked")
+    appointment_id = insert_appointment(appointment)
+    if appointment_id is None and occupies:
+        availability.release(mongo.db.slot_occupancy, appointment.slot_start)
+    return appointment_id
+
+def slot_availability(start, end):
+    return availability.availability(mongo.db.slot_occupancy, start, end)
+
+def rebuild_slot_occupancy(start=None, end=None):
+    return availability.rebuild(mongo.db.appointments, mongo.db.slot_occupancy, start, end)
+
+def _record_stats(changes):
+    """Apply (slot_start, deltas) changes to the statistics counters.
+
+    Called after the appointment write has succeeded; a failure here is
+    logged rather than raised, and `flask rebuild-stats` repairs it.
+    """
     try:
-        print(f"🔍 Searching for appointments for user: {user_id}")
-        print(f"🔍 User ID type: {type(user_id)}")
-        
-        # Convert user_id to ObjectId if it's a valid ObjectId string
-        if ObjectId.is_valid(user_id):
-            query_user_id = ObjectId(user_id)
-        else:
-            query_user_id = user_id
-            
-        appointments_data = mongo.db.appointments.find({'user_id': query_user_id}).sort('date', -1)
-        appointments = []
-        for appointment_data in appointments_data:
-            appointments.append(Appointment.from_dict(appointment_data))
-        print(f"✅ Found {len(appointments)} appointments for user {user_id}")
-        return appointments
-    except Exception as e:
-        print(f"❌ Error finding appointments by user ID: {e}")
-        return []
+        stats.record(mongo.db.appointment_stats, changes)
+    except PyMongoError as e:
+        logger.error("❌ Could not update appointment statistics (run flask rebuild-stats): %s", e)
 
-def update_appointment_status(appointment_id, new_status):
-    """Update the status of an appointment with validation"""
+def appointment_statistics(month_from=None, month_to=None):
+    return stats.read(mongo.db.appointment_stats, month_from, month_to, now=availability.local_now())
+
+def verify_appointment_statistics():
+    return stats.verify(mongo.db.appointments, mongo.db.appointment_stats)
+
+def rebuild_appointment_statistics():
+    return stats.rebuild(mongo.db.appointments, mongo.db.appointment_stats)
+
+def _sync_occupancy(slot_start, old_status, new_status):
+    """Give back or take a slot place when a status change crosses OCCUPYING_STATUSES.
+
+    Returns False only when a place was needed and the slot is full.
+    """
+    if slot_start is None:
+        return True
+    was_occupying = availability.occupies_slot(old_status)
+    occupying = availability.occupies_slot(new_status)
+    if was_occupying and not occupying:
+        availability.release(mongo.db.slot_occupancy, slot_start)
+    elif occupying and not was_occupying:
+        return availability.reserve(mongo.db.slot_occupancy, slot_start)
+    return True
+
+def _insert_many(collection, documents):
+    """insert_many(ordered=False) that reports failures per document.
+
+    Returns (inserted_count, {index: error message}) where index is the
+    position in `documents`.
+    """
+    if not documents:
+        return 0, {}
     try:
-        print(f"🔍 Updating appointment {appointment_id} to status: {new_status}")
-        print(f"🔍 ID type: {type(appointment_id)}")
-        
-        # Validate status first
-        if not Appointment.is_valid_status(new_status):
-            print(f"❌ Invalid status: {new_status}")
-            return False, "Invalid status value"
-        
-        # Build query based on ID type
-        if ObjectId.is_valid(appointment_id):
-            query = {'_id': ObjectId(appointment_id)}
-            print(f"🔍 Using ObjectId query")
-        else:
-            query = {'_id': appointment_id}
-            print(f"🔍 Using string ID query")
-        
-        # First check if appointment exists
-        appointment_data = mongo.db.appointments.find_one(query)
-        if not appointment_data:
-            print(f"❌ Appointment not found: {appointment_id}")
-            # Debug: list all appointments
-            all_appointments = list(mongo.db.appointments.find({}, {'_id': 1, 'status': 1}))
-            print(f"🔍 All available appointments: {[(str(apt['_id']), apt.get('status')) for apt in all_appointments]}")
-            return False, "Appointment not found"
-            
-        print(f"✅ Found appointment: {appointment_data}")
-        current_db_status = appointment_data.get('status', 'Pending')
-        print(f"🔍 Current status in DB: {current_db_status}")
-        
-        # For admin updates, if current_status is 'Pending', only allow 'Approved' or 'Rejected'
-        if current_db_status == 'Pending' and not Appointment.is_admin_updatable_status(new_status):
-            print(f"❌ Cannot update from Pending to {new_status}. Only 'Approved' or 'Rejected' allowed.")
-            return False, "Can only approve or reject pending appointments"
-        
-        # Update the appointment
-        result = mongo.db.appointments.update_one(
+        result = collection.insert_many(documents, ordered=False)
+        appointments_cache.bump()
+        return len(result.inserted_ids), {}
+    except BulkWriteError as e:
+        appointments_cache.bump()
+        errors = {}
+        for write_error in e.details.get('writeErrors', []):
+            if write_error.get('code') == 11000:
+                field = duplicate_key_field(write_error)
+                errors[write_error['index']] = f"Duplicate {field or 'key'}"
+            else:
+                errors[write_error['index']] = write_error.get('errmsg', 'Write failed')
+        return e.details.get('nInserted', 0), errors
+
+def insert_users_bulk(users):
+    """Insert many users in one unordered batch; see _insert_many for the return value"""
+    inserted, errors = _insert_many(mongo.db.users, [user.to_dict() for user in users])
+    logger.info("✅ Bulk inserted %s users (%s failed)", inserted, len(errors))
+    return inserted, errors
+
+def insert_appointments_bulk(appointments):
+    """Insert many appointments in one unordered batch; see _insert_many for the return value"""
+    snapshots = _user_snapshots({appointment.user_id for appointment in appointments})
+    documents = []
+    for appointment in appointments:
+        document = appointment.to_dict()
+        if str(appointment.user_id) in snapshots:
+            document['user_info'] = snapshots[str(appointment.user_id)]
+        documents.append(document)
+    inserted, errors = _insert_many(mongo.db.appointments, documents)
+    # Imported history is counted as-is, without a capacity check
+    availability.add_bookings(mongo.db.slot_occupancy, [
+        appointment.slot_start for index, appointment in enumerate(appointments)
+        if index not in errors and availability.occupies_slot(appointment.status)
+    ])
+    _record_stats([
+        (appointment.slot_start, stats.appointment_deltas({
+            'status': appointment.status, 'concern_type': appointment.concern_type, 'attended': appointment.attended
+        }))
+        for index, appointment in enumerate(appointments) if index not in errors
+    ])
+    logger.info("✅ Bulk inserted %s appointments (%s failed)", inserted, len(errors))
+    return inserted, errors
+
+def propagate_user_info(user_id, user_data=None):
+    """Rewrite the user_info snapshot on a user's appointments after their username or ID number changed.
+
+    user_data is the current user document if the caller already has it.
+    Only appointments whose snapshot differs are written. Returns the
+    number of appointments updated.
+    """
+    if user_data is None:
+        user_data = mongo.db.users.find_one(id_query(user_id), dict.fromkeys(USER_SNAPSHOT_FIELDS, 1))
+        if user_data is None:
+            logger.info("❌ No user found with ID: %s", user_id)
+            return 0
+    snapshot = user_snapshot(user_data)
+    result = mongo.db.appointments.update_many(
+        {'user_id': {'$in': id_candidates(str(user_id))}, 'user_info': {'$ne': snapshot}},
+        {'$set': {'user_info': snapshot}}
+    )
+    if result.modified_count:
+        logger.info("✅ Refreshed user_info on %s appointments of user %s", result.modified_count, user_id)
+        appointments_cache.bump()
+    return result.modified_count
+
+def watch_user_identity_changes(resume_token=None):
+    """Change stream of users whose username or id_number was updated or replaced.
+
+    Events carry the current document (fullDocument). Raises
+    OperationFailure without a replica set, like watch_appointments.
+    """
+    pipeline = [{'$match': {'$or': [
+        {'operationType': 'replace'},
+        *({'operationType': 'update', f'updateDescription.updatedFields.{field}': {'$exists': True}} for field in USER_SNAPSHOT_FIELDS)
+    ]}}]
+    options = {'full_document': 'updateLookup'}
+    if resume_token:
+        options['resume_after'] = resume_token
+    return mongo.db.users.watch(pipeline, **options)
+
+def existing_user_ids(user_ids):
+    """The subset of user_ids (as strings) that belong to a stored user, in one query"""
+    return set(_find_users_by_ids(user_ids))
+
+def find_appointment_documents_by_user_id(user_id, limit=None, after=None, fields=None):
+    """A user's appointments as raw BSON, newest first.
+
+    With a limit this is one keyset page; returns (documents, next_cursor),
+    next_cursor being None on the last page or when unpaginated. fields
+    (names from fieldsets.APPOINTMENT_FIELDS) limits the documents to what
+    they need plus the sort keys; asking only for user_id, date,
+    preferred_time and _id makes it a covered query on tupt_user_id_date_time.
+    """
+    query = id_query(user_id, 'user_id')
+    if after:
+        query.update(keyset_filter(after, descending=True))
+    projection = field_projection(fields, required=APPOINTMENT_SORT_KEYS) if fields else None
+    _log_coverage('appointments', 'tupt_user_id_date_time', projection)
+    cursor = raw_collection('appointments').find(query, projection).sort(sort_spec(descending=True))
+    if limit is None:
+        return list(cursor), None
+    rows = list(cursor.limit(limit + 1))
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def status_source_filter(new_status):
+    """Filter clause matching appointments whose current status may move to new_status"""
+    sources = Appointment.allowed_source_statuses(new_status)
+    if 'Pending' in sources:
+        # Documents whose status is missing or null are treated as Pending
+        sources = sources + [None]
+    return {'status': {'$in': sources}}
+
+def update_appointment_status(appointment_id, new_status):
+    """Atomically move an appointment to new_status if the transition table allows it.
+
+    The allowed source statuses are part of the filter, so checking and
+    updating is a single find_one_and_update and concurrent admins cannot
+    race each other. Returns (appointment, message) with the updated
+    appointment; raises AppointmentNotFound or InvalidStatusTransition,
+    or SlotUnavailable when reopening an appointment whose slot has
+    since filled up (the status change is then undone).
+    """
+    logger.debug("🔍 Updating appointment %s to status: %s", appointment_id, new_status)
+    
+    # Validate status first
+    if not Appointment.is_valid_status(new_status):
+        logger.warning("❌ Invalid status: %s", new_status)
+        raise InvalidStatusTransition("Invalid status value")
+    
+    query = {**id_query(appointment_id), **status_source_filter(new_status)}
+    with causal_session() as session:
+        previous = mongo.db.appointments.find_one_and_update(
             query,
-            {'$set': {'status': new_status}}
+            {'$set': {'status': new_status}},
+            return_document=ReturnDocument.BEFORE,
+            session=session
         )
-        
-        print(f"✅ Update result - matched: {result.matched_count}, modified: {result.modified_count}")
-        
-        if result.modified_count > 0:
-            print(f"✅ Successfully updated appointment {appointment_id} from {current_db_status} to {new_status}")
-            return True, "Status updated successfully"
-        elif result.matched_count > 0:
-            print(f"⚠️ Status already set to {new_status}")
-            return True, "Status was already set to the requested value"
-        else:
-            print(f"⚠️ No changes made to appointment {appointment_id}")
-            print(f"🔍 Query used: {query}")
-            print(f"🔍 New status: {new_status}")
-            return False, "No changes made - appointment not found or status unchanged"
-            
-    except Exception as e:
-        print(f"❌ Error updating appointment status: {e}")
-        import traceback
-        print(f"🔍 Stack trace: {traceback.format_exc()}")
-        return False, f"Error updating appointment: {str(e)}"
+        # Only on failure: tell a missing appointment apart from a disallowed transition
+        current = None if previous else mongo.db.appointments.find_one(
+            id_query(appointment_id), {'status': 1}, session=session
+        )
+    
+    if previous is None:
+        if current is None:
+            logger.info("❌ Appointment not found: %s", appointment_id)
+            diagnostics.record_miss(mongo.db.appointments, 'update_status', appointment_id)
+            raise AppointmentNotFound("Appointment not found")
+        current_status = current.get('status') or 'Pending'
+        logger.warning("❌ Cannot update from %s to %s", current_status, new_status)
+        if current_status == 'Pending':
+            raise InvalidStatusTransition("Can only approve or reject pending appointments")
+        raise InvalidStatusTransition(f"Cannot change status from {current_status} to {new_status}")
+    
+    previous_status = previous.get('status') or 'Pending'
+    appointment = Appointment.from_dict(previous).replace(status=new_status)
+    if previous_status == new_status:
+        logger.info("⚠️ Status already set to %s", new_status)
+        return appointment, "Status was already set to the requested value"
+    
+    if not _sync_occupancy(previous.get('slot_start'), previous_status, new_status):
+        mongo.db.appointments.update_one(
+            {'_id': previous['_id'], 'status': new_status},
+            {'$set': {'status': previous_status}}
+        )
+        logger.info("❌ Cannot reopen appointment %s: slot is fully booked", appointment_id)
+        raise SlotUnavailable("This time slot is fully booked")
+    
+    logger.info("✅ Successfully updated appointment %s from %s to %s", appointment_id, previous_status, new_status)
+    appointments_cache.bump()
+    _record_stats([(previous.get('slot_start'), stats.change_deltas(previous, dict(previous, status=new_status)))])
+    return appointment, "Status updated successfully"
+
+# Change stream events forwarded to dashboards; invalidations etc. are dropped
+CHANGE_FEED_OPERATIONS = ['insert', 'update', 'replace', 'delete']
+
+def _change_feed_pipeline(statuses=None, date_from=None, date_to=None):
+    conditions = []
+    if statuses:
+        statuses = list(statuses)
+        if 'Pending' in statuses:
+            # Documents whose status is missing or null are treated as Pending
+            statuses.append(None)
+        conditions.append({'fullDocument.status': {'$in': statuses}})
+    date_range = {}
+    if date_from:
+        date_range['$gte'] = date_from
+    if date_to:
+        date_range['$lte'] = date_to
+    if date_range:
+        conditions.append({'fullDocument.date': date_range})
+
+    match = {'operationType': {'$in': CHANGE_FEED_OPERATIONS}}
+    if conditions:
+        # Deleted documents have no fullDocument to filter on; always pass them through
+        match = {'$and': [match, {'$or': [{'operationType': 'delete'}, {'$and': conditions}]}]}
+    return [{'$match': match}]
+
+def watch_appointments(statuses=None, date_from=None, date_to=None, resume_token=None, max_await_ms=None):
+    """Open a change stream on appointments, optionally filtered by status and date window.
+
+    Returns (change_stream, reset). When resume_token can no longer be
+    resumed from (expired from the oplog or malformed) the stream starts
+    from now instead and reset is True, so the client knows to refetch.
+    Raises OperationFailure when the server does not support change
+    streams (change streams need a replica set; a single-node one started
+    with `mongod --replSet rs0` and `rs.initiate()` is enough).
+    """
+    pipeline = _change_feed_pipeline(statuses, date_from, date_to)
+    options = {'full_document': 'updateLookup', 'max_await_time_ms': max_await_ms}
+    if resume_token:
+        try:
+            return mongo.db.appointments.watch(pipeline, resume_after={'_data': resume_token}, **options), False
+        except OperationFailure as e:
+            logger.warning("⚠️ Cannot resume appointment change stream from %s: %s", resume_token, e)
+    return mongo.db.appointments.watch(pipeline, **options), bool(resume_token)
+
+def appointment_change_event(change):
+    """Client payload for one change stream event, with rows shaped like /all-appointments"""
+    document = change.get('fullDocument')
+    updated_fields = change.get('updateDescription', {}).get('updatedFields', {})
+    return {
+        'operation': change['operationType'],
+        'appointment_id': change['documentKey']['_id'],
+        'appointment': _serialize_appointments_with_users([document])[0] if document else None,
+        'updated_fields': sorted(updated_fields)
+    }
 
 def get_all_appointments():
     """Get all appointments (for admin/counselor view)"""
     try:
-        appointments = list(mongo.db.appointments.find().sort('created_at', -1))
-        print(f"🔍 Found {len(appointments)} total appointments in database")
-        for apt in appointments:
-            print(f"   - {apt['_id']}: {apt.get('user_id', 'N/A')} - {apt.get('date', 'N/A')} - {apt.get('status', 'N/A')}")
+        appointments = list(list_collection('appointments').find().sort('created_at', -1))
+        logger.debug("🔍 Found %s total appointments in database", len(appointments))
+        if logger.isEnabledFor(logging.DEBUG):
+            for apt in appointments:
+                logger.debug("   - %s: %s - %s - %s", apt['_id'], apt.get('user_id', 'N/A'), apt.get('date', 'N/A'), apt.get('status', 'N/A'))
         return [Appointment.from_dict(appointment) for appointment in appointments]
     except Exception as e:
-        print(f"Error getting all appointments: {e}")
+        logger.error("Error getting all appointments: %s", e)
         return []
 
+def find_appointments_in_range(start, end, statuses=None, limit=None):
+    """Appointments with start <= slot_start < end in slot order, optionally filtered by status.
+
+    Both bounds and the status list are answered from the
+    (slot_start, status) index. Returns (appointments, truncated).
+    """
+    query = {'slot_start': {'$gte': start, '$lt': end}}
+    if statuses:
+        # Missing status means Pending; null matches it and is in the index
+        values = list(statuses) + ([None] if 'Pending' in statuses else [])
+        query['status'] = {'$in': values}
+    cursor = list_collection('appointments').find(query).sort('slot_start', ASCENDING)
+    if limit is None:
+        return [Appointment.from_dict(row) for row in cursor], False
+    rows = list(cursor.limit(limit + 1))
+    logger.debug("🔍 Found %s appointments between %s and %s", min(len(rows), limit), start, end)
+    return [Appointment.from_dict(row) for row in rows[:limit]], len(rows) > limit
+
 def find_appointment_by_id(appointment_id):
     """Find a specific appointment by ID - handles both ObjectId and string IDs"""
     try:
-        print(f"🔍 Searching for appointment with ID: {appointment_id}")
-        print(f"🔍 ID type: {type(appointment_id)}")
-        
-        # Try to find by ObjectId first if it's a valid ObjectId
-        if ObjectId.is_valid(appointment_id):
-            print(f"🔍 Trying to find by ObjectId: {appointment_id}")
-            appointment_data = mongo.db.appointments.find_one({'_id': ObjectId(appointment_id)})
-            if appointment_data:
-                print(f"✅ Appointment found using ObjectId: {appointment_data}")
-                return Appointment.from_dict(appointment_data), None
+        logger.debug("🔍 Searching for appointment with ID: %s", appointment_id)
+        logger.debug("🔍 ID type: %s", type(appointment_id))
         
-        # If not found or not valid ObjectId, try as string ID
-        print(f"🔍 Trying to find by string ID: {appointment_id}")
-        appointment_data = mongo.db.appointments.find_one({'_id': appointment_id})
+        appointment_data = mongo.db.appointments.find_one(id_query(appointment_id))
         
         if appointment_data:
-            print(f"✅ Appointment found using string ID: {appointment_data}")
+            logger.debug("✅ Appointment found: %s", appointment_data['_id'])
             return Appointment.from_dict(appointment_data), None
         else:
-            print(f"❌ No appointment found with ID: {appointment_id}")
-            # Debug: list all appointments to see what's available
-            all_appointments = list(mongo.db.appointments.find({}, {'_id': 1, 'user_id': 1, 'date': 1}))
-            print(f"🔍 All available appointments: {[(str(apt['_id']), apt.get('user_id'), apt.get('date')) for apt in all_appointments]}")
+            logger.info("❌ No appointment found with ID: %s", appointment_id)
+            diagnostics.record_miss(mongo.db.appointments, 'find', appointment_id)
             return None, "Appointment not found"
             
     except Exception as e:
-        print(f"❌ Error finding appointment by ID: {e}")
-        import traceback
-        print(f"🔍 Stack trace: {traceback.format_exc()}")
+        logger.exception("❌ Error finding appointment by ID: %s", e)
         return None, f"Error finding appointment: {str(e)}"
 
 def update_appointment_attended(appointment_id, attended_status):
@@ -234,185 +791,379 @@ def update_appointment_attended(appointment_id, attended_status):
     Update the attended status of an appointment - handles both ObjectId and string IDs
     """
     try:
-        print(f"🔍 Updating appointment {appointment_id} attended status to: {attended_status}")
-        print(f"🔍 ID type: {type(appointment_id)}")
+        logger.debug("🔍 Updating appointment %s attended status to: %s", appointment_id, attended_status)
+        logger.debug("🔍 ID type: %s", type(appointment_id))
         
-        # Build query based on ID type
-        if ObjectId.is_valid(appointment_id):
-            query = {'_id': ObjectId(appointment_id)}
-            print(f"🔍 Using ObjectId query for attendance update")
-        else:
-            query = {'_id': appointment_id}
-            print(f"🔍 Using string ID query for attendance update")
-        
-        result = mongo.db.appointments.update_one(
-            query,
-            {'$set': {'attended': attended_status}}
+        # Only matches when the value actually changes, so the counters move exactly once
+        previous = mongo.db.appointments.find_one_and_update(
+            {**id_query(appointment_id), 'attended': {'$ne': attended_status}},
+            {'$set': {'attended': attended_status}},
+            projection={'status': 1, 'concern_type': 1, 'attended': 1, 'slot_start': 1},
+            return_document=ReturnDocument.BEFORE
         )
         
-        print(f"✅ Update result - matched: {result.matched_count}, modified: {result.modified_count}")
-        
-        if result.modified_count > 0:
-            print(f"✅ Successfully updated appointment {appointment_id} attended status to {attended_status}")
+        if previous is not None:
+            logger.info("✅ Successfully updated appointment %s attended status to %s", appointment_id, attended_status)
+            appointments_cache.bump()
+            _record_stats([(previous.get('slot_start'), stats.change_deltas(previous, dict(previous, attended=attended_status)))])
             return True, "Attendance status updated successfully"
-        elif result.matched_count > 0:
-            print(f"⚠️ Attendance status already set to {attended_status}")
+        elif mongo.db.appointments.find_one(id_query(appointment_id), {'_id': 1}) is not None:
+            logger.info("⚠️ Attendance status already set to %s", attended_status)
             return True, "Attendance status was already set"
         else:
-            print(f"⚠️ No changes made to appointment {appointment_id}")
-            # Debug what's in the database
-            all_appointments = list(mongo.db.appointments.find({}, {'_id': 1}))
-            print(f"🔍 Available appointment IDs: {[str(apt['_id']) for apt in all_appointments]}")
+            logger.warning("⚠️ No changes made to appointment %s", appointment_id)
+            diagnostics.record_miss(mongo.db.appointments, 'update_attended', appointment_id)
             return False, "Appointment not found or no changes made"
             
     except Exception as e:
-        print(f"❌ Error updating attendance status: {e}")
-        import traceback
-        print(f"🔍 Stack trace: {traceback.format_exc()}")
+        logger.exception("❌ Error updating attendance status: %s", e)
         return False, str(e)
 
-def get_appointments_with_user_details():
-    """Get all appointments with user information using aggregation - FIXED VERSION"""
-    try:
-        print("🔍 Starting get_appointments_with_user_details...")
-        
-        # First, let's debug what's in the collections
-        users_count = mongo.db.users.count_documents({})
-        appointments_count = mongo.db.appointments.count_documents({})
-        print(f"🔍 Users count: {users_count}, Appointments count: {appointments_count}")
-        
-        # Get all appointments first to see user_id types
-        all_appointments = list(mongo.db.appointments.find({}, {'user_id': 1}))
-        user_id_types = {}
-        for apt in all_appointments:
-            user_id = apt.get('user_id')
-            user_id_types[str(type(user_id))] = user_id_types.get(str(type(user_id)), 0) + 1
-        print(f"🔍 User ID types in appointments: {user_id_types}")
-        
-        # Get all users to see _id types
-        all_users = list(mongo.db.users.find({}, {'_id': 1, 'username': 1}))
-        user_id_types = {}
-        for user in all_users:
-            user_id = user.get('_id')
-            user_id_types[str(type(user_id))] = user_id_types.get(str(type(user_id)), 0) + 1
-        print(f"🔍 User _id types in users collection: {user_id_types}")
-        print(f"🔍 Sample users: {[(str(user['_id']), user.get('username')) for user in all_users[:3]]}")
-        
-        # Enhanced pipeline that handles both ObjectId and string user_ids
-        pipeline = [
-            {
-                '$lookup': {
-                    'from': 'users',
-                    'let': { 'appointment_user_id': '$user_id' },
-                    'pipeline': [
-                        {
-                            '$match': {
-                                '$expr': {
-                                    '$or': [
-                                        { '$eq': ['$_id', '$$appointment_user_id'] },
-                                        { '$eq': [{ '$toString': '$_id' }, '$$appointment_user_id'] },
-                                        { '$eq': ['$_id', { '$toObjectId': '$$appointment_user_id' }] }
-                                    ]
-                                }
-                            }
-                        }
-                    ],
-                    'as': 'user_info'
-                }
-            },
-            {
-                '$unwind': {
-                    'path': '$user_info',
-                    'preserveNullAndEmptyArrays': True
-                }
-            },
-            {
-                '$sort': {'date': 1, 'preferred_time': 1}
-            }
-        ]
-        
-        appointments_cursor = mongo.db.appointments.aggregate(pipeline)
-        appointments = list(appointments_cursor)
-        
-        print(f"🔍 Found {len(appointments)} appointments with user details")
+MAX_BATCH_OPERATIONS = 500
+
+def _validate_batch_operation(operation, current):
+    """Check one batch item against the stored appointment; returns an error message or None"""
+    status = operation.get('status')
+    attended = operation.get('attended')
+    if status is None and attended is None:
+        return "Nothing to update: provide status and/or attended"
+    if status is not None and not Appointment.is_valid_status(status):
+        return "Invalid status value"
+    if attended is not None and not isinstance(attended, bool):
+        return "attended must be a boolean value (true/false)"
+    if current is None:
+        return "Appointment not found"
+    if status is not None:
+        current_status = current.get('status') or 'Pending'
+        if not Appointment.can_transition(current_status, status):
+            if current_status == 'Pending':
+                return "Can only approve or reject pending appointments"
+            return f"Cannot change status from {current_status} to {status}"
+    if attended is not None and Appointment.is_future_slot(current.get('slot_start'), current.get('date')):
+        return "Cannot mark attendance for future appointments"
+    return None
+
+def batch_update_appointments(operations):
+    """Apply many {id, status?, attended?} updates with one read and one unordered bulk_write.
+
+    Every item is validated with the same rules as the single-item
+    endpoints. Each write only matches while the appointment still has
+    the status and attended value that were read, so a concurrent change
+    makes that item fail rather than overwrite it, and an item only
+    succeeds if its own write matched. An appointment named more than
+    once fails on every occurrence after the first. Returns one result
+    dict per operation, in order.
+    """
+    results = [{'id': operation.get('id'), 'success': False} for operation in operations]
+    
+    candidates = [
+        candidate
+        for operation in operations if operation.get('id')
+        for candidate in id_candidates(str(operation['id']))
+    ]
+    with causal_session() as session:
+        return _apply_batch_operations(operations, results, candidates, session)
+
+def _apply_batch_operations(operations, results, candidates, session):
+    current_by_id = {}
+    if candidates:
+        for document in mongo.db.appointments.find(
+            {'_id': {'$in': candidates}}, {'status': 1, 'date': 1, 'slot_start': 1, 'attended': 1}, session=session
+        ):
+            current_by_id[str(document['_id'])] = document
+    
+    writes = []
+    write_positions = []
+    reserved = set()
+    releases = {}
+    seen_ids = set()
+    for position, operation in enumerate(operations):
+        if operation.get('id') is not None:
+            if str(operation['id']) in seen_ids:
+                # Every item is checked against the same read, so a second one could never be right
+                results[position]['error'] = "Appointment appears more than once in this batch"
+                continue
+            seen_ids.add(str(operation['id']))
+        current = current_by_id.get(str(operation.get('id')))
+        error = _validate_batch_operation(operation, current)
+        if error:
+            results[position]['error'] = error
+            continue
         
-        # Convert to serializable format
-        serialized_appointments = []
-        for apt in appointments:
-            # Handle both ObjectId and string _id
-            appointment_id = str(apt['_id']) if isinstance(apt['_id'], ObjectId) else apt['_id']
-            
-            # Get user info with fallbacks
-            user_info = {}
-            if apt.get('user_info'):
-                user_info = {
-                    'username': apt['user_info'].get('username', 'Unknown'),
-                    'id_number': apt['user_info'].get('id_number', 'N/A')
-                }
-            else:
-                # If no user info found, try to find the user directly
-                user_id = apt.get('user_id')
-                if user_id:
-                    user = find_user_by_id(user_id)
-                    if user:
-                        user_info = {
-                            'username': user.username,
-                            'id_number': user.id_number or 'N/A'
-                        }
-                    else:
-                        user_info = {
-                            'username': 'Unknown',
-                            'id_number': 'N/A'
-                        }
+        # Occupancy and statistics follow the state read above, so each write
+        # only matches while the appointment is still in exactly that state
+        conditions = [{'_id': current['_id']}]
+        update = {}
+        if operation.get('status') is not None:
+            update['status'] = operation['status']
+            current_status = current.get('status') or 'Pending'
+            conditions.append({'status': current.get('status')})
+            slot_start = current.get('slot_start')
+            was_occupying = availability.occupies_slot(current_status)
+            if slot_start and was_occupying != availability.occupies_slot(operation['status']):
+                if was_occupying:
+                    releases[position] = slot_start
+                elif availability.reserve(mongo.db.slot_occupancy, slot_start):
+                    reserved.add(position)
                 else:
-                    user_info = {
-                        'username': 'Unknown',
-                        'id_number': 'N/A'
-                    }
-            
-            serialized_apt = {
-                '_id': appointment_id,
-                'user_id': str(apt['user_id']) if isinstance(apt['user_id'], ObjectId) else apt['user_id'],
-                'date': apt['date'],
-                'preferred_time': apt['preferred_time'],
-                'concern_type': apt['concern_type'],
-                'status': apt.get('status', 'Pending'),
-                'attended': apt.get('attended', False),
-                'created_at': apt.get('created_at', ''),
-                'user_info': user_info
-            }
-            serialized_appointments.append(serialized_apt)
-        
-        # Debug: Check how many appointments have user info
-        with_user_info = len([apt for apt in serialized_appointments if apt['user_info'].get('username') != 'Unknown'])
-        print(f"🔍 Appointments with user info: {with_user_info}/{len(serialized_appointments)}")
-        
-        return serialized_appointments
-        
+                    results[position]['error'] = "This time slot is fully booked"
+                    continue
+        if operation.get('attended') is not None:
+            update['attended'] = operation['attended']
+            conditions.append({'attended': True} if current.get('attended') else {'attended': {'$ne': True}})
+        writes.append(UpdateOne({'$and': conditions}, {'$set': update}))
+        write_positions.append(position)
+    
+    if not writes:
+        return results
+    
+    failed_positions = {}
+    try:
+        result = mongo.db.appointments.bulk_write(writes, ordered=False, session=session)
+        matched = result.matched_count
+    except BulkWriteError as e:
+        for write_error in e.details.get('writeErrors', []):
+            failed_positions[write_positions[write_error['index']]] = write_error.get('errmsg', 'Write failed')
+        matched = e.details.get('nMatched', 0)
+    
+    unmatched = len(writes) - len(failed_positions) - matched
+    if unmatched > 0:
+        # Some filters stopped matching between the read and the write. The
+        # bulk result only counts matches, so find out which from the
+        # documents: an item whose document doesn't show its change did not match.
+        written_ids = [current_by_id[str(operations[position]['id'])]['_id'] for position in write_positions]
+        now = {
+            str(document['_id']): document
+            for document in mongo.db.appointments.find({'_id': {'$in': written_ids}}, {'status': 1, 'attended': 1}, session=session)
+        }
+        undecided = []
+        for position in write_positions:
+            if position in failed_positions:
+                continue
+            operation = operations[position]
+            document = now.get(str(operation['id']))
+            if document is None:
+                failed_positions[position] = "Appointment not found"
+                unmatched -= 1
+            elif any(
+                operation.get(field) is not None and document.get(field, default) != operation[field]
+                for field, default in (('status', 'Pending'), ('attended', False))
+            ):
+                failed_positions[position] = "Status was changed concurrently; reload and retry"
+                unmatched -= 1
+            else:
+                undecided.append(position)
+        if unmatched > 0:
+            # Someone else made the same change in between, so there is no
+            # telling which of these writes matched; report none as ours
+            logger.warning("⚠️ Batch update raced identical concurrent changes on %s items; "
+                           "run flask rebuild-occupancy and rebuild-stats --verify", len(undecided))
+            for position in undecided:
+                failed_positions[position] = "Status was changed concurrently; reload and retry"
+    
+    changes = []
+    for position in write_positions:
+        if position in failed_positions:
+            results[position]['error'] = failed_positions[position]
+            if position in reserved:
+                availability.release(mongo.db.slot_occupancy, current_by_id[str(operations[position]['id'])]['slot_start'])
+            continue
+        if position in releases:
+            availability.release(mongo.db.slot_occupancy, releases[position])
+        operation = operations[position]
+        results[position]['success'] = True
+        for field in ('status', 'attended'):
+            if operation.get(field) is not None:
+                results[position][field] = operation[field]
+        current = current_by_id[str(operation['id'])]
+        updated = dict(current, **{field: operation[field] for field in ('status', 'attended') if operation.get(field) is not None})
+        changes.append((current.get('slot_start'), stats.change_deltas(current, updated)))
+    
+    succeeded = sum(1 for item in results if item['success'])
+    logger.info("✅ Batch update: %s succeeded, %s failed", succeeded, len(results) - succeeded)
+    if succeeded:
+        appointments_cache.bump()
+        _record_stats(changes)
+    return results
+
+# Fields the admin listing reads; user_info is the snapshot embedded at insert
+LISTING_PROJECTION = {
+    'user_id': 1, 'date': 1, 'preferred_time': 1, 'concern_type': 1, 'status': 1,
+    'attended': 1, 'slot_start': 1, 'created_at': 1, 'user_info': 1
+}
+
+def _listing_cursor(match=None, limit=None, batch_size=None, fields=None):
+    """Appointments in listing order, read with a single find over the tupt_date_time index.
+
+    With fields (names from fieldsets.LISTING_FIELDS) only those plus the
+    sort keys are read; asking for nothing beyond date, preferred_time and
+    _id makes the listing a covered query on that index.
+    """
+    projection = field_projection(fields, required=APPOINTMENT_SORT_KEYS) if fields else LISTING_PROJECTION
+    _log_coverage('appointments', 'tupt_date_time', projection)
+    cursor = _cached_listing_collection('appointments').find(match or {}, projection).sort(sort_spec())
+    if limit:
+        cursor = cursor.limit(limit)
+    if batch_size:
+        cursor = cursor.batch_size(batch_size)
+    return cursor
+
+def _user_identity_map():
+    """Users already fetched during this request, keyed by str(_id); None marks a miss"""
+    if has_request_context():
+        if 'user_identity_map' not in g:
+            g.user_identity_map = {}
+        return g.user_identity_map
+    return {}
+
+def resolve_users(user_ids):
+    """Fetch the users behind a set of IDs with a single $in query.
+
+    Each distinct user is fetched at most once per request; IDs already in
+    the identity map (including known misses) cost nothing.
+    """
+    identity_map = _user_identity_map()
+    missing = {str(user_id) for user_id in user_ids if user_id and str(user_id) not in identity_map}
+    if missing:
+        identity_map.update(_find_users_by_ids(missing, USER_SNAPSHOT_FIELDS, _cached_listing_collection('users')))
+        for user_id in missing:
+            identity_map.setdefault(user_id, None)
+        logger.debug("🔍 Resolved %s user IDs in one query", len(missing))
+    return identity_map
+
+def _serialize_appointments_with_users(appointments, fields=None):
+    """Serialize a batch of appointments, resolving users for rows without a user_info snapshot in one query"""
+    users = {}
+    if fields is None or 'user_info' in fields:
+        unresolved = {apt.get('user_id') for apt in appointments if not apt.get('user_info')}
+        users = resolve_users(unresolved) if unresolved else {}
+    if fields is not None:
+        return [_serialize_listing_fields(apt, users, fields) for apt in appointments]
+    return [_serialize_appointment_with_user(apt, users) for apt in appointments]
+
+def _listing_user_info(apt, users):
+    # Get user info with fallbacks
+    user_data = apt.get('user_info') or users.get(str(apt.get('user_id')))
+    if user_data:
+        return {
+            'username': user_data.get('username', 'Unknown'),
+            'id_number': user_data.get('id_number') or 'N/A'
+        }
+    return {
+        'username': 'Unknown',
+        'id_number': 'N/A'
+    }
+
+# Values the listing shows for fields a stored appointment doesn't have
+LISTING_DEFAULTS = {'status': 'Pending', 'attended': False, 'created_at': ''}
+
+def _serialize_listing_fields(apt, users, fields):
+    """Only the requested listing fields of a projected row"""
+    return {
+        field: _listing_user_info(apt, users) if field == 'user_info' else apt.get(field, LISTING_DEFAULTS.get(field))
+        for field in fields
+    }
+
+def _serialize_appointment_with_user(apt, users):
+    user_info = _listing_user_info(apt, users)
+    
+    return {
+        '_id': apt['_id'],
+        'user_id': apt['user_id'],
+        'date': apt['date'],
+        'preferred_time': apt['preferred_time'],
+        'concern_type': apt['concern_type'],
+        'status': apt.get('status') or 'Pending',
+        'attended': apt.get('attended', False),
+        'slot_start': apt.get('slot_start'),
+        'created_at': apt.get('created_at', ''),
+        'user_info': user_info
+    }
+
+def get_appointments_with_user_details(fields=None):
+    """Get all appointments with user information from the embedded user_info snapshots
+
+    Served from appointments_cache (per fieldset) until a write bumps the data version.
+    """
+    try:
+        return appointments_cache.get_or_compute(('all', fields), lambda: _load_appointments_with_user_details(fields))
     except Exception as e:
-        print(f"❌ Error getting appointments with user details: {e}")
-        import traceback
-        print(f"🔍 Stack trace: {traceback.format_exc()}")
+        logger.exception("❌ Error getting appointments with user details: %s", e)
         return []
 
+def _load_appointments_with_user_details(fields=None):
+    logger.debug("🔍 Starting get_appointments_with_user_details...")
+    
+    appointments = list(_listing_cursor(fields=fields))
+    
+    logger.debug("🔍 Found %s appointments with user details", len(appointments))
+    
+    # Convert to serializable format
+    serialized_appointments = _serialize_appointments_with_users(appointments, fields)
+    
+    # Debug: Check how many appointments have user info
+    if logger.isEnabledFor(logging.DEBUG):
+        with_user_info = sum(1 for apt in serialized_appointments if apt.get('user_info', {}).get('username') != 'Unknown')
+        logger.debug("🔍 Appointments with user info: %s/%s", with_user_info, len(serialized_appointments))
+    
+    return serialized_appointments
+
+def iter_appointments_with_user_details(batch_size, fields=None):
+    """Yield serialized appointments with user information as the cursor is read.
+
+    Used by the streaming responses; rows are pulled from the server
+    `batch_size` at a time instead of being materialized in one list.
+    """
+    cursor = _listing_cursor(batch_size=batch_size, fields=fields)
+    batch = []
+    for apt in cursor:
+        batch.append(apt)
+        if len(batch) >= batch_size:
+            yield from _serialize_appointments_with_users(batch, fields)
+            batch = []
+    if batch:
+        yield from _serialize_appointments_with_users(batch, fields)
+
+def get_appointments_page_with_user_details(limit, after=None, fields=None):
+    """One keyset page of appointments with user information.
+
+    Returns (appointments, next_cursor); next_cursor is None on the last page.
+    Each page is one index range scan on (date, preferred_time, _id); user
+    details come from the embedded user_info snapshot, so its cost does not
+    grow with the collection.
+    Pages are cached per (limit, after, fields) in the size-bounded appointments_cache.
+    """
+    key = ('page', limit, json_util.dumps(after), fields)
+    return appointments_cache.get_or_compute(key, lambda: _load_appointments_page_with_user_details(limit, after, fields))
+
+def _load_appointments_page_with_user_details(limit, after, fields=None):
+    match = keyset_filter(after) if after else None
+    # Fetch one extra row to know whether another page exists
+    rows = list(_listing_cursor(match=match, limit=limit + 1, fields=fields))
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    rows = rows[:limit]
+    logger.debug("🔍 Found %s appointments for page (more: %s)", len(rows), next_cursor is not None)
+    return _serialize_appointments_with_users(rows, fields), next_cursor
+
 def debug_appointments():
     """Debug function to see all appointments and their structure"""
     try:
-        print("🔍 DEBUG: All appointments in database:")
-        appointments = list(mongo.db.appointments.find())
-        print(f"Total appointments: {len(appointments)}")
+        logger.debug("🔍 DEBUG: All appointments in database:")
+        appointments = list(list_collection('appointments').find())
+        logger.debug("Total appointments: %s", len(appointments))
         
-        for i, apt in enumerate(appointments):
-            print(f"Appointment {i+1}:")
-            print(f"  _id: {apt['_id']} (type: {type(apt['_id'])})")
-            print(f"  user_id: {apt.get('user_id', 'N/A')} (type: {type(apt.get('user_id'))})")
-            print(f"  date: {apt.get('date', 'N/A')}")
-            print(f"  status: {apt.get('status', 'N/A')}")
-            print(f"  concern_type: {apt.get('concern_type', 'N/A')}")
-            print(f"  attended: {apt.get('attended', 'N/A')}")
-            print("  ---")
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, apt in enumerate(appointments):
+                logger.debug("Appointment %s:", i+1)
+                logger.debug("  _id: %s (type: %s)", apt['_id'], type(apt['_id']))
+                logger.debug("  user_id: %s (type: %s)", apt.get('user_id', 'N/A'), type(apt.get('user_id')))
+                logger.debug("  date: %s", apt.get('date', 'N/A'))
+                logger.debug("  status: %s", apt.get('status', 'N/A'))
+                logger.debug("  concern_type: %s", apt.get('concern_type', 'N/A'))
+                logger.debug("  attended: %s", apt.get('attended', 'N/A'))
+                logger.debug("  ---")
             
         return appointments
     except Exception as e:
-        print(f"❌ Error debugging appointments: {e}")
+        logger.error("❌ Error debugging appointments: %s", e)
         return []
\ No newline at end of file
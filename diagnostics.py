@@ -0,0 +1,69 @@
+import logging
+import threading
+from collections import Counter
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_SIZE = 10
+MAX_SAMPLE_SIZE = 100
+
+_settings = {'enabled': False, 'sample_size': DEFAULT_SAMPLE_SIZE}
+_lock = threading.Lock()
+_counters = Counter()
+
+def init_app(app):
+    """Read DIAGNOSTICS_ENABLED / DIAGNOSTICS_SAMPLE_SIZE from the app config"""
+    _settings['enabled'] = bool(app.config.get('DIAGNOSTICS_ENABLED', False))
+    sample_size = int(app.config.get('DIAGNOSTICS_SAMPLE_SIZE', DEFAULT_SAMPLE_SIZE))
+    _settings['sample_size'] = max(1, min(sample_size, MAX_SAMPLE_SIZE))
+
+def _increment(key):
+    with _lock:
+        _counters[key] += 1
+
+def sample_nearby_ids(collection, raw_id, limit):
+    """Up to `limit` _ids around raw_id, read from the _id index.
+
+    Two bounded range scans (before and after the missed value) instead of
+    listing the whole collection.
+    """
+    key = ObjectId(raw_id) if ObjectId.is_valid(raw_id) else raw_id
+    half = limit // 2
+    # limit(0) means "no limit" to the driver, so skip the scan instead
+    before = list(
+        collection.find({'_id': {'$lt': key}}, {'_id': 1}).sort('_id', DESCENDING).limit(half)
+    ) if half else []
+    after = list(
+        collection.find({'_id': {'$gt': key}}, {'_id': 1}).sort('_id', ASCENDING).limit(limit - len(before))
+    )
+    return [str(document['_id']) for document in reversed(before)] + [str(document['_id']) for document in after]
+
+def record_miss(collection, operation, raw_id):
+    """Count an ID lookup that matched nothing; sample nearby IDs when diagnostics are on.
+
+    Returns the sampled IDs, or None when diagnostics are disabled.
+    """
+    _increment(f'{collection.name}.{operation}.misses')
+    if not _settings['enabled']:
+        return None
+
+    _increment('samples')
+    try:
+        nearby = sample_nearby_ids(collection, raw_id, _settings['sample_size'])
+    except Exception as e:
+        logger.warning("⚠️ Could not sample IDs near %s in %s: %s", raw_id, collection.name, e)
+        return None
+    logger.info("🔍 %s miss for %s in %s; nearby IDs: %s", operation, raw_id, collection.name, nearby)
+    return nearby
+
+def snapshot():
+    """Current settings and counters, for the diagnostics endpoint"""
+    with _lock:
+        counters = dict(_counters)
+    return {
+        'enabled': _settings['enabled'],
+        'sample_size': _settings['sample_size'],
+        'counters': counters
+    }
@@ -0,0 +1,31 @@
+import hashlib
+from flask import current_app, request
+
+# Clients may keep a copy but must revalidate it on every use
+CACHE_CONTROL = 'private, no-cache'
+
+def raw_etag(documents, *extra):
+    """Strong ETag over the raw BSON of documents plus other parts of the response.
+
+    Each document's bytes start with its length, so concatenating them is
+    unambiguous; no decoding or JSON serialization is needed.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for document in documents:
+        digest.update(document.raw)
+    for part in extra:
+        digest.update(repr(part).encode('utf-8'))
+    return digest.hexdigest()
+
+def is_not_modified(etag):
+    """True if the request's If-None-Match already names etag"""
+    return request.if_none_match.contains_weak(etag)
+
+def tag(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
+
+def not_modified(etag):
+    """Empty 304 response carrying the same validators as the 200 would"""
+    return tag(current_app.response_class(status=304), etag)
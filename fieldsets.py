@@ -0,0 +1,27 @@
+# Field names clients may pick with ?fields=, per response shape. These are
+# the keys of the API representation; database.py maps them to the stored
+# fields it has to read.
+APPOINTMENT_FIELDS = (
+    '_id', 'user_id', 'date', 'preferred_time', 'concern_type', 'status',
+    'attended', 'slot_start', 'created_at', 'formatted_created_at'
+)
+LISTING_FIELDS = (
+    '_id', 'user_id', 'date', 'preferred_time', 'concern_type', 'status',
+    'attended', 'slot_start', 'created_at', 'user_info'
+)
+USER_FIELDS = ('user_id', 'username', 'id_number', 'birthdate', 'role', 'created_at')
+
+def parse_fields(args, allowed):
+    """Read ?fields=a,b,c; None means every field.
+
+    Returns the requested names in the order given, without duplicates.
+    Raises ValueError with a client-facing message for unknown names.
+    """
+    value = args.get('fields', '').strip()
+    if not value:
+        return None
+    fields = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in allowed]
+    if unknown or not fields:
+        raise ValueError(f'Unknown fields: {", ".join(unknown)}. Allowed: {", ".join(allowed)}')
+    return fields
@@ -0,0 +1,30 @@
+import os
+
+# PORT and WEB_CONCURRENCY are set by the hosting platform
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '').lower() in ('1', 'true', 'yes')
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+# Threaded workers so long-lived /appointments/stream connections hold a
+# thread, not a whole process; each worker serves up to `threads` at once,
+# of which at most SSE_MAX_STREAMS go to streams (the rest get a 503)
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+
+def post_fork(server, worker):
+    # The logging listener thread stays behind in the master; start one per
+    # worker. Without --preload the app (and its load_dotenv) hasn't been
+    # imported yet, so load .env first or LOG_LEVEL / LOG_LEVELS from it would
+    # be ignored; with --preload the app's configure_logging won't run again.
+    from dotenv import load_dotenv
+    load_dotenv()
+    from logging_config import reinit_after_fork
+    reinit_after_fork()
+    from passwords import hasher
+    hasher.after_fork()
+
+def post_worker_init(worker):
+    # Runs in each worker once the app is loaded (in the master with --preload)
+    from app import app
+    from database import init_worker
+    init_worker(app)
@@ -0,0 +1,87 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 15
+
+class HealthMonitor:
+    """Pings MongoDB on a background thread and caches the outcome.
+
+    Request paths read the cached state instead of paying for a live
+    round trip on every call.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._get_db = None
+        self.interval = DEFAULT_INTERVAL
+        self._state = {
+            'ok': None,
+            'latency_ms': None,
+            'last_error': None,
+            'last_checked': None,
+            'appointments_count': None,
+        }
+
+    def start(self, get_db, interval=DEFAULT_INTERVAL):
+        """Run one check now, then keep checking every `interval` seconds"""
+        self._get_db = get_db
+        self.interval = interval
+        self.check()
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='mongo-health', daemon=True)
+        self._thread.start()
+        # Stop pinging once the process starts shutting down
+        atexit.register(self.stop)
+
+    def after_fork(self):
+        """Drop thread state inherited from the parent process; call before start()"""
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def check(self):
+        started = time.perf_counter()
+        try:
+            db = self._get_db()
+            db.command('ping')
+            latency_ms = round((time.perf_counter() - started) * 1000, 2)
+            # Metadata-only count; no collection scan
+            appointments_count = db.appointments.estimated_document_count()
+            update = {'ok': True, 'latency_ms': latency_ms, 'appointments_count': appointments_count}
+        except Exception as e:
+            update = {'ok': False, 'latency_ms': None, 'last_error': str(e)}
+            logger.warning("⚠️ MongoDB health check failed: %s", e)
+
+        update['last_checked'] = datetime.utcnow().isoformat()
+        with self._lock:
+            was_ok = self._state['ok']
+            self._state.update(update)
+        if was_ok is False and update['ok']:
+            logger.info("✅ MongoDB connection recovered")
+
+    def state(self):
+        with self._lock:
+            return dict(self._state)
+
+    def is_healthy(self):
+        """False only once a check has actually failed; unknown counts as healthy"""
+        with self._lock:
+            return self._state['ok'] is not False
+
+monitor = HealthMonitor()
@@ -0,0 +1,203 @@
+import csv
+import io
+import json
+import logging
+import multiprocessing
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+import click
+from models import User, Appointment, parse_slot_start
+from passwords import hasher, hash_password, is_bcrypt_hash
+from database import insert_users_bulk, insert_appointments_bulk, existing_user_ids
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+FORMATS = ('jsonl', 'csv')
+KINDS = ('users', 'appointments')
+
+USER_REQUIRED_FIELDS = ['username', 'id_number', 'birthdate']
+APPOINTMENT_REQUIRED_FIELDS = ['user_id', 'date', 'preferred_time', 'concern_type']
+
+def guess_format(filename):
+    """Pick jsonl/csv from a file name; None if it can't be told"""
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    if extension == '.csv':
+        return 'csv'
+    return None
+
+def read_rows(stream, file_format):
+    """Yield (row_number, row) from a text stream; row is an Exception for unparseable lines"""
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # CSV has no nulls or booleans; treat empty cells as missing
+            yield reader.line_num, {key: value for key, value in row.items() if key and value != ''}
+        return
+
+    for row_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield row_number, ValueError(f"Invalid JSON: {e}")
+            continue
+        if not isinstance(row, dict):
+            yield row_number, ValueError("Each line must be a JSON object")
+            continue
+        yield row_number, row
+
+def _chunks(rows, chunk_size):
+    chunk = []
+    for item in rows:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _missing_fields(row, required_fields):
+    return [field for field in required_fields if not row.get(field)]
+
+
+def _prepare_users(chunk, executor):
+    """Validate user rows and hash their passwords across the process pool"""
+    errors = {}
+    valid = []
+    for row_number, row in chunk:
+        if isinstance(row, Exception):
+            errors[row_number] = str(row)
+            continue
+        missing = _missing_fields(row, USER_REQUIRED_FIELDS)
+        if not row.get('password') and not row.get('password_hash'):
+            missing.append('password')
+        if missing:
+            errors[row_number] = f"Missing fields: {', '.join(missing)}"
+            continue
+        if row.get('password') and len(str(row['password'])) < 6:
+            errors[row_number] = "Password must be at least 6 characters long"
+            continue
+        # Anything else would only fail later, at login, inside bcrypt
+        if row.get('password_hash') and not is_bcrypt_hash(row['password_hash']):
+            errors[row_number] = "password_hash must be a bcrypt hash"
+            continue
+        valid.append((row_number, row))
+
+    to_hash = [(row_number, row) for row_number, row in valid if not row.get('password_hash')]
+    # hash_password directly: the worker processes have no use for the request-path thread pool
+    passwords = [str(row['password']) for _, row in to_hash]
+    hashes = executor.map(hash_password, passwords, itertools.repeat(hasher.rounds), chunksize=8)
+    hashed = {row_number: password_hash for (row_number, _), password_hash in zip(to_hash, hashes)}
+
+    prepared = []
+    for row_number, row in valid:
+        data = {key: value for key, value in row.items() if key != 'password'}
+        data['password_hash'] = row.get('password_hash') or hashed[row_number]
+        data.setdefault('role', 'user')
+        try:
+            prepared.append((row_number, User.from_dict(data)))
+        except (KeyError, TypeError, ValueError) as e:
+            errors[row_number] = f"Invalid user: {e}"
+    return prepared, errors
+
+def _parse_bool(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes')
+
+def _prepare_appointments(chunk, executor=None):
+    """Validate appointment rows, checking every referenced user with one query"""
+    errors = {}
+    valid = []
+    for row_number, row in chunk:
+        if isinstance(row, Exception):
+            errors[row_number] = str(row)
+            continue
+        missing = _missing_fields(row, APPOINTMENT_REQUIRED_FIELDS)
+        if missing:
+            errors[row_number] = f"Missing fields: {', '.join(missing)}"
+            continue
+        if row.get('status') and not Appointment.is_valid_status(row['status']):
+            errors[row_number] = f"Invalid status: {row['status']}"
+            continue
+        valid.append((row_number, row))
+
+    known_users = existing_user_ids({str(row['user_id']) for _, row in valid})
+    prepared = []
+    for row_number, row in valid:
+        if str(row['user_id']) not in known_users:
+            errors[row_number] = f"Unknown user_id: {row['user_id']}"
+            continue
+        data = dict(
+            row,
+            attended=_parse_bool(row.get('attended', False)),
+            slot_start=parse_slot_start(row['date'], row['preferred_time'])
+        )
+        try:
+            prepared.append((row_number, Appointment.from_dict(data)))
+        except (KeyError, TypeError, ValueError) as e:
+            errors[row_number] = f"Invalid appointment: {e}"
+    return prepared, errors
+
+def import_records(kind, stream, file_format, chunk_size=DEFAULT_CHUNK_SIZE, workers=None):
+    """Stream rows from a JSONL/CSV text stream into users or appointments.
+
+    Rows are validated and written a chunk at a time with
+    insert_many(ordered=False), so one bad row never blocks the rest.
+    Returns a report with counts and per-row errors (by line number).
+    """
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of: {', '.join(KINDS)}")
+    if file_format not in FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+
+    prepare = _prepare_users if kind == 'users' else _prepare_appointments
+    insert_bulk = insert_users_bulk if kind == 'users' else insert_appointments_bulk
+    report = {'kind': kind, 'rows': 0, 'inserted': 0, 'failed': 0, 'errors': []}
+
+    def add_errors(errors):
+        report['failed'] += len(errors)
+        for row_number in sorted(errors):
+            if len(report['errors']) < MAX_REPORTED_ERRORS:
+                report['errors'].append({'row': row_number, 'error': errors[row_number]})
+
+    # spawn, not fork: the parent holds Mongo client and logging threads
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=context) as executor:
+        for chunk in _chunks(read_rows(stream, file_format), chunk_size):
+            report['rows'] += len(chunk)
+            prepared, errors = prepare(chunk, executor)
+
+            inserted, write_errors = insert_bulk([record for _, record in prepared])
+            report['inserted'] += inserted
+            # Reported together so validation and write errors stay in row order
+            errors.update({prepared[index][0]: message for index, message in write_errors.items()})
+            add_errors(errors)
+            logger.info("📥 Imported %s/%s %s rows so far", report['inserted'], report['rows'], kind)
+
+    report['errors_truncated'] = report['failed'] > len(report['errors'])
+    return report
+
+def register_commands(app):
+    @app.cli.command('import-data')
+    @click.argument('kind', type=click.Choice(KINDS))
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'file_format', type=click.Choice(FORMATS), help='Defaults to the file extension')
+    @click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE, show_default=True, help='Rows per insert_many batch')
+    @click.option('--workers', type=int, help='Password hashing processes (default: CPU count)')
+    def import_data_command(kind, path, file_format, chunk_size, workers):
+        """Bulk import users or appointments from a JSONL or CSV file."""
+        file_format = file_format or guess_format(path)
+        if not file_format:
+            raise click.UsageError('Cannot tell the file format; pass --format jsonl|csv')
+        with io.open(path, encoding='utf-8', newline='') as stream:
+            report = import_records(kind, stream, file_format, chunk_size=chunk_size, workers=workers)
+        for item in report['errors']:
+            click.echo(f"row {item['row']}: {item['error']}")
+        click.echo(f"{report['inserted']} of {report['rows']} {kind} imported, {report['failed']} failed")
@@ -0,0 +1,51 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s'
+
+_listener = None
+
+def _parse_module_levels(spec):
+    """Parse LOG_LEVELS such as 'database=DEBUG,routes=WARNING' into a dict"""
+    levels = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, level = item.partition('=')
+        if name and level:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def configure_logging():
+    """Send all records through a queue to a background thread that writes stderr.
+
+    Request threads only pay for an enqueue, and records below the configured
+    level are dropped before their message is ever formatted. LOG_LEVEL sets
+    the default level (INFO) and LOG_LEVELS overrides it per module.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+
+    for name, level in _parse_module_levels(os.environ.get('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(level)
+
+def reinit_after_fork():
+    """Give a forked worker its own queue and listener thread; threads don't survive fork"""
+    global _listener
+    _listener = None
+    configure_logging()
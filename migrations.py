@@ -0,0 +1,328 @@
+import logging
+from datetime import datetime
+import click
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateMany, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from database import mongo, set_canonical_ids, rebuild_slot_occupancy, rebuild_appointment_statistics, verify_appointment_statistics, id_candidates, user_snapshot, propagate_user_info, watch_user_identity_changes, USER_SNAPSHOT_FIELDS
+from cache import appointments_cache
+from models import parse_slot_start
+
+logger = logging.getLogger(__name__)
+
+# Progress for each migration lives in the migration_state collection so an
+# interrupted run can be restarted and picks up where it stopped.
+
+def _state(name):
+    return mongo.db.migration_state.find_one({'_id': name}) or {'_id': name}
+
+def _save_state(name, **fields):
+    mongo.db.migration_state.update_one({'_id': name}, {'$set': fields}, upsert=True)
+
+def _type_census(collection, field):
+    """Count documents per BSON type of a field, e.g. {'objectId': 10, 'string': 2}"""
+    pipeline = [{'$group': {'_id': {'$type': f'${field}'}, 'count': {'$sum': 1}}}]
+    return {row['_id']: row['count'] for row in mongo.db[collection].aggregate(pipeline)}
+
+def _rekey_documents(collection, batch_size, report, on_rekeyed=None):
+    """Replace string _ids that are valid ObjectIds with the ObjectId form.
+
+    _id is immutable, so each document is re-inserted under ObjectId(old_id).
+    The document being moved is parked in migration_state first; if the
+    process dies between the delete and the insert, the next run finishes it.
+    """
+    state_name = f'rekey_{collection}'
+    pending = _state(state_name).get('pending')
+    if pending:
+        logger.info("🔁 Resuming interrupted re-key of %s %s", collection, pending['_id'])
+        _finish_rekey(collection, pending, on_rekeyed)
+
+    last_id = ''
+    while True:
+        batch = list(mongo.db[collection].find(
+            {'_id': {'$type': 'string', '$gt': last_id}}
+        ).sort('_id', ASCENDING).limit(batch_size))
+        if not batch:
+            break
+        for document in batch:
+            last_id = document['_id']
+            if not ObjectId.is_valid(document['_id']):
+                report['unconvertible'].append({'collection': collection, '_id': document['_id']})
+                continue
+            _save_state(state_name, pending=document)
+            _finish_rekey(collection, document, on_rekeyed)
+            report['rekeyed'][collection] += 1
+        logger.info("✅ Re-keyed %s %s so far", report['rekeyed'][collection], collection)
+
+def _finish_rekey(collection, document, on_rekeyed):
+    old_id = document['_id']
+    new_document = dict(document, _id=ObjectId(old_id))
+    # Delete first so unique indexes (e.g. users.username) don't reject the copy
+    mongo.db[collection].delete_one({'_id': old_id})
+    try:
+        mongo.db[collection].insert_one(new_document)
+    except DuplicateKeyError:
+        # Only a copy already inserted by a previous, interrupted run counts as
+        # done. Any other collision (e.g. the username was registered since the
+        # delete) leaves the document parked in migration_state for the next run.
+        if mongo.db[collection].find_one({'_id': new_document['_id']}, {'_id': 1}) is None:
+            logger.error("❌ Could not re-insert %s %s; it is kept in migration_state until a re-run succeeds", collection, old_id)
+            raise
+    if on_rekeyed:
+        on_rekeyed(old_id, new_document['_id'])
+    _save_state(f'rekey_{collection}', pending=None)
+
+def _repoint_user_references(old_id, new_id):
+    mongo.db.appointments.update_many({'user_id': old_id}, {'$set': {'user_id': new_id}})
+
+def _convert_appointment_user_ids(batch_size, report):
+    last_id = None
+    while True:
+        query = {'user_id': {'$type': 'string'}}
+        if last_id is not None:
+            query['_id'] = {'$gt': last_id}
+        batch = list(mongo.db.appointments.find(query, {'user_id': 1}).sort('_id', ASCENDING).limit(batch_size))
+        if not batch:
+            break
+        operations = []
+        for appointment in batch:
+            last_id = appointment['_id']
+            if ObjectId.is_valid(appointment['user_id']):
+                operations.append(UpdateOne(
+                    {'_id': appointment['_id'], 'user_id': appointment['user_id']},
+                    {'$set': {'user_id': ObjectId(appointment['user_id'])}}
+                ))
+            else:
+                report['unconvertible'].append({
+                    'collection': 'appointments',
+                    '_id': str(appointment['_id']),
+                    'user_id': appointment['user_id']
+                })
+        if operations:
+            result = mongo.db.appointments.bulk_write(operations, ordered=False)
+            report['converted_user_ids'] += result.modified_count
+        logger.info("✅ Converted %s appointment user_ids so far", report['converted_user_ids'])
+
+def find_orphaned_appointments(limit=100):
+    """Appointments whose user_id matches no user, using the plain indexed $lookup"""
+    pipeline = [
+        {'$lookup': {'from': 'users', 'localField': 'user_id', 'foreignField': '_id', 'as': 'user'}},
+        {'$match': {'user': {'$size': 0}}},
+        {'$project': {'_id': 1, 'user_id': 1}},
+        {'$limit': limit}
+    ]
+    return [
+        {'_id': str(row['_id']), 'user_id': str(row.get('user_id'))}
+        for row in mongo.db.appointments.aggregate(pipeline)
+    ]
+
+def migrate_ids(batch_size=500):
+    """Convert users._id, appointments._id and appointments.user_id to ObjectId.
+
+    Safe to re-run: every step only touches documents that still hold
+    string IDs. Canonical-ID mode is switched on only when nothing
+    unconvertible is left behind.
+    """
+    report = {
+        'before': {
+            'users._id': _type_census('users', '_id'),
+            'appointments._id': _type_census('appointments', '_id'),
+            'appointments.user_id': _type_census('appointments', 'user_id'),
+        },
+        'rekeyed': {'users': 0, 'appointments': 0},
+        'converted_user_ids': 0,
+        'unconvertible': [],
+    }
+    logger.info("🔍 ID types before migration: %s", report['before'])
+
+    _rekey_documents('users', batch_size, report, on_rekeyed=_repoint_user_references)
+    _rekey_documents('appointments', batch_size, report)
+    _convert_appointment_user_ids(batch_size, report)
+
+    report['orphans'] = find_orphaned_appointments()
+    canonical = not report['unconvertible']
+    set_canonical_ids(canonical)
+    report['canonical_ids'] = canonical
+    logger.info("✅ Migration finished: %s re-keyed, %s user_ids converted, %s unconvertible, %s orphans",
+                report['rekeyed'], report['converted_user_ids'], len(report['unconvertible']), len(report['orphans']))
+    return report
+
+def _parse_stored_datetime(value):
+    """datetime for an ISO string written by the old to_dict; None if it can't be read"""
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (ValueError, AttributeError):
+        return None
+
+def _slot_updates(appointment, report, recompute=False):
+    fields = {}
+    if recompute or 'slot_start' not in appointment:
+        # Stored even when None so unreadable dates are not revisited on every run
+        slot_start = parse_slot_start(appointment.get('date'), appointment.get('preferred_time'))
+        if slot_start is None:
+            report['unparseable'].append({
+                '_id': str(appointment['_id']), 'date': appointment.get('date'), 'preferred_time': appointment.get('preferred_time')
+            })
+        if 'slot_start' not in appointment or appointment['slot_start'] != slot_start:
+            fields['slot_start'] = slot_start
+    return fields
+
+def _created_at_updates(document, report):
+    created_at = document.get('created_at')
+    if not isinstance(created_at, str):
+        return {}
+    parsed = _parse_stored_datetime(created_at)
+    if parsed is None:
+        report['unparseable'].append({'_id': str(document['_id']), 'created_at': created_at})
+        return {}
+    return {'created_at': parsed}
+
+def _appointment_updates(appointment, report, recompute=False):
+    return dict(_slot_updates(appointment, report, recompute), **_created_at_updates(appointment, report))
+
+def _backfill(collection, query, projection, build_updates, batch_size, report):
+    last_id = None
+    while True:
+        batch_query = dict(query, _id={'$gt': last_id}) if last_id is not None else query
+        batch = list(mongo.db[collection].find(batch_query, projection).sort('_id', ASCENDING).limit(batch_size))
+        if not batch:
+            break
+        operations = []
+        for document in batch:
+            last_id = document['_id']
+            fields = build_updates(document, report)
+            if fields:
+                operations.append(UpdateOne({'_id': document['_id']}, {'$set': fields}))
+        if operations:
+            result = mongo.db[collection].bulk_write(operations, ordered=False)
+            report['updated'][collection] += result.modified_count
+        logger.info("✅ Backfilled %s %s so far", report['updated'][collection], collection)
+
+def backfill_slots(batch_size=500, recompute=False):
+    """Store appointments.slot_start and turn string created_at values into datetimes.
+
+    Only documents still missing slot_start or holding a string
+    created_at are touched, so the backfill can be re-run at any time.
+    recompute re-derives slot_start on every appointment, e.g. to clear
+    the midnight slots earlier versions stored for free-text times.
+    Run it after migrate-ids: batches walk _id in order, which assumes
+    a single _id type.
+    """
+    report = {'updated': {'appointments': 0, 'users': 0}, 'unparseable': []}
+    query = {} if recompute else {'$or': [{'slot_start': {'$exists': False}}, {'created_at': {'$type': 'string'}}]}
+    _backfill(
+        'appointments',
+        query,
+        {'date': 1, 'preferred_time': 1, 'slot_start': 1, 'created_at': 1},
+        lambda appointment, report: _appointment_updates(appointment, report, recompute), batch_size, report
+    )
+    _backfill('users', {'created_at': {'$type': 'string'}}, {'created_at': 1}, _created_at_updates, batch_size, report)
+    logger.info("✅ Slot backfill finished: %s updated, %s unparseable", report['updated'], len(report['unparseable']))
+    return report
+
+def backfill_user_info(batch_size=500):
+    """Embed (or refresh) the user_info snapshot on every appointment.
+
+    Walks users in _id order and rewrites each user's appointments with one
+    UpdateMany per user, skipping appointments whose snapshot is already
+    current, so it is safe to re-run. Appointments whose user no longer
+    exists are counted as orphans and keep resolving at read time.
+    """
+    report = {'users': 0, 'updated': 0, 'orphans': 0}
+    projection = dict.fromkeys(USER_SNAPSHOT_FIELDS, 1)
+    last_id = None
+    while True:
+        query = {'_id': {'$gt': last_id}} if last_id is not None else {}
+        batch = list(mongo.db.users.find(query, projection).sort('_id', ASCENDING).limit(batch_size))
+        if not batch:
+            break
+        operations = []
+        for user in batch:
+            last_id = user['_id']
+            snapshot = user_snapshot(user)
+            operations.append(UpdateMany(
+                {'user_id': {'$in': id_candidates(str(user['_id']))}, 'user_info': {'$ne': snapshot}},
+                {'$set': {'user_info': snapshot}}
+            ))
+        result = mongo.db.appointments.bulk_write(operations, ordered=False)
+        report['users'] += len(batch)
+        report['updated'] += result.modified_count
+        logger.info("✅ Backfilled user_info for %s users (%s appointments) so far", report['users'], report['updated'])
+    report['orphans'] = mongo.db.appointments.count_documents({'user_info': {'$exists': False}})
+    if report['updated']:
+        appointments_cache.bump()
+    logger.info("✅ user_info backfill finished: %s appointments updated, %s orphans", report['updated'], report['orphans'])
+    return report
+
+def propagate_user_changes(on_propagated=None):
+    """Follow username / id_number changes on users and refresh their appointments' snapshots.
+
+    Runs until interrupted. The resume token is saved in migration_state
+    after each event, so a restarted job catches up on changes made while
+    it was down (as long as they are still in the oplog).
+    """
+    name = 'user_info_propagation'
+    with watch_user_identity_changes(_state(name).get('resume_token')) as stream:
+        for change in stream:
+            user = change.get('fullDocument')
+            if user is not None:
+                updated = propagate_user_info(change['documentKey']['_id'], user)
+                if on_propagated:
+                    on_propagated(change['documentKey']['_id'], updated)
+            _save_state(name, resume_token=stream.resume_token, updated_at=datetime.utcnow())
+
+def register_commands(app):
+    @app.cli.command('migrate-ids')
+    @click.option('--batch-size', default=500, show_default=True, help='Documents per batch')
+    def migrate_ids_command(batch_size):
+        """Convert string user/appointment IDs to ObjectId and report orphans."""
+        report = migrate_ids(batch_size=batch_size)
+        for item in report['unconvertible']:
+            click.echo(f"unconvertible: {item}")
+        for orphan in report['orphans']:
+            click.echo(f"orphan appointment {orphan['_id']} -> user {orphan['user_id']}")
+        click.echo(f"canonical_ids={report['canonical_ids']}")
+
+    @app.cli.command('backfill-slots')
+    @click.option('--batch-size', default=500, show_default=True, help='Documents per batch')
+    @click.option('--recompute', is_flag=True, help='Re-derive slot_start on every appointment')
+    def backfill_slots_command(batch_size, recompute):
+        """Add slot_start to appointments and store created_at as a date."""
+        report = backfill_slots(batch_size=batch_size, recompute=recompute)
+        for item in report['unparseable']:
+            click.echo(f"unparseable: {item}")
+        click.echo(f"updated appointments={report['updated']['appointments']} users={report['updated']['users']}")
+
+    @app.cli.command('rebuild-occupancy')
+    @click.option('--from', 'date_from', type=click.DateTime(formats=['%Y-%m-%d']), help='First day to recount')
+    @click.option('--to', 'date_to', type=click.DateTime(formats=['%Y-%m-%d']), help='Last day to recount')
+    def rebuild_occupancy_command(date_from, date_to):
+        """Recount slot_occupancy from appointments (run after backfill-slots)."""
+        days = rebuild_slot_occupancy(date_from, date_to)
+        click.echo(f"rebuilt occupancy for {days} days")
+
+    @app.cli.command('backfill-user-info')
+    @click.option('--batch-size', default=500, show_default=True, help='Users per batch')
+    def backfill_user_info_command(batch_size):
+        """Embed the user_info snapshot (username, id_number) on existing appointments."""
+        report = backfill_user_info(batch_size=batch_size)
+        click.echo(f"users={report['users']} updated appointments={report['updated']} orphans={report['orphans']}")
+
+    @app.cli.command('propagate-user-info')
+    def propagate_user_info_command():
+        """Keep appointment user_info snapshots in step with user edits (runs until stopped)."""
+        click.echo("watching users for username / id_number changes (Ctrl+C to stop)")
+        propagate_user_changes(lambda user_id, updated: click.echo(f"user {user_id}: refreshed {updated} appointments"))
+
+    @app.cli.command('rebuild-stats')
+    @click.option('--verify', is_flag=True, help='Only compare the counters with a recount')
+    def rebuild_stats_command(verify):
+        """Recount appointment_stats from appointments (run after backfill-slots)."""
+        if verify:
+            mismatches = verify_appointment_statistics()
+            for key, mismatch in sorted(mismatches.items()):
+                click.echo(f"{key}: stored {mismatch['stored']} counted {mismatch['counted']}")
+            click.echo(f"{len(mismatches)} counter documents differ")
+            return
+        documents = rebuild_appointment_statistics()
+        click.echo(f"rebuilt {documents} counter documents")
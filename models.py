@@ -1,27 +1,139 @@
-from flask_login import UserMixin
 from bson import ObjectId
-import bcrypt
-from datetime import datetime
+from datetime import datetime, timedelta
+from passwords import hasher
+
+DISPLAY_DATE_FORMAT = '%B %d, %Y at %I:%M %p'
+_MONTHS = ('January', 'February', 'March', 'April', 'May', 'June', 'July',
+           'August', 'September', 'October', 'November', 'December')
+
+def format_display_date(value):
+    """Same text as value.strftime(DISPLAY_DATE_FORMAT) in the C locale, without strftime's overhead"""
+    hour = value.hour % 12 or 12
+    meridiem = 'AM' if value.hour < 12 else 'PM'
+    return f'{_MONTHS[value.month - 1]} {value.day:02d}, {value.year} at {hour:02d}:{value.minute:02d} {meridiem}'
+
+def as_object_id(value):
+    """ObjectId for a valid ObjectId string; anything else is returned unchanged"""
+    if not value or isinstance(value, ObjectId):
+        return value
+    return ObjectId(value) if ObjectId.is_valid(value) else value
+
+def parse_datetime(value):
+    """datetime for a stored timestamp (datetime or ISO string); now if it can't be read"""
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (ValueError, AttributeError):
+        return datetime.utcnow()
+
+# preferred_time has always been free text; these are the forms clients send
+TIME_FORMATS = ('%H:%M', '%H:%M:%S', '%I:%M %p', '%I:%M%p', '%I %p')
+
+def parse_slot_time(time_value):
+    """(hour, minute) of a preferred time such as '14:30' or '2:30 PM'; None if it can't be read"""
+    for time_format in TIME_FORMATS:
+        try:
+            slot_time = datetime.strptime(str(time_value).strip().upper(), time_format)
+        except ValueError:
+            continue
+        return slot_time.hour, slot_time.minute
+    return None
+
+def parse_slot_start(date_value, time_value):
+    """Start of an appointment slot from its YYYY-MM-DD date and preferred time.
+
+    None if either can't be read. Free-text times such as 'Morning' are
+    not guessed at: pooling them in one slot would make them compete for
+    the same capacity.
+    """
+    try:
+        day = datetime.strptime(date_value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+    slot_time = parse_slot_time(time_value)
+    if slot_time is None:
+        return None
+    return day + timedelta(hours=slot_time[0], minutes=slot_time[1])
+
+_set = object.__setattr__
+
+class Model:
+    """Base for slotted, immutable models; use replace() to get a changed copy.
+
+    Subclasses list their stored fields in FIELDS and any lazily computed
+    values in CACHED. _build(*values) writes the slots directly and skips
+    __init__'s conversions, for decoding documents that are already stored.
+    """
+    __slots__ = ()
+    FIELDS = ()
+    CACHED = ()
+
+    @classmethod
+    def _build(cls, *values):
+        instance = object.__new__(cls)
+        for name, value in zip(cls.FIELDS, values):
+            _set(instance, name, value)
+        for name in cls.CACHED:
+            _set(instance, name, None)
+        return instance
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable; use replace()")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def replace(self, **changes):
+        unknown = changes.keys() - set(self.FIELDS)
+        if unknown:
+            raise TypeError(f"{type(self).__name__} has no field(s): {', '.join(sorted(unknown))}")
+        return self._build(*(changes.get(name, getattr(self, name)) for name in self.FIELDS))
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.FIELDS if name != 'password_hash')
+        return f'{type(self).__name__}({fields})'
+
+
+class User(Model):
+    FIELDS = ('username', 'password_hash', 'id_number', 'birthdate', 'role', '_id', 'created_at')
+    __slots__ = FIELDS
+
+    # The attributes flask_login.UserMixin provided
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
 
-class User(UserMixin):
     def __init__(self, username, password_hash, id_number=None, birthdate=None, role="user", _id=None, created_at=None):
-        self.username = username
-        self.password_hash = password_hash
-        self.id_number = id_number
-        self.birthdate = birthdate
-        self.role = role  # 'user' or 'admin'
-        self._id = _id or ObjectId()
-        self.created_at = created_at or datetime.utcnow()
+        _set(self, 'username', username)
+        _set(self, 'password_hash', password_hash)
+        _set(self, 'id_number', id_number)
+        _set(self, 'birthdate', birthdate)
+        _set(self, 'role', role)  # 'user' or 'admin'
+        _set(self, '_id', _id or ObjectId())
+        _set(self, 'created_at', created_at or datetime.utcnow())
 
     def get_id(self):
         return str(self._id)
 
+    def __eq__(self, other):
+        if isinstance(other, User):
+            return self.get_id() == other.get_id()
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.get_id())
+
     @staticmethod
     def set_password(password):
-        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        """Hash on the shared bcrypt pool; raises PasswordPoolBusy when it is saturated"""
+        return hasher.hash(password)
 
     def check_password(self, password):
-        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+        return hasher.verify(password, self.password_hash)
+
+    def needs_rehash(self):
+        return hasher.needs_rehash(self.password_hash)
 
     def to_dict(self):
         return {
@@ -31,76 +143,159 @@ class User(UserMixin):
             'birthdate': self.birthdate,
             'role': self.role,
             '_id': self._id,  # Keep as ObjectId for database consistency
+            'created_at': self.created_at
+        }
+
+    def to_json(self):
+        """Profile fields for API responses; never includes the password hash"""
+        return {
+            'username': self.username,
+            'id_number': self.id_number,
+            'birthdate': self.birthdate,
+            'user_id': str(self._id),
+            'role': self.role,
             'created_at': self.created_at.isoformat() if isinstance(self.created_at, datetime) else self.created_at
         }
 
+    # API field -> how to read it from a stored document, for sparse responses
+    JSON_READERS = {
+        'user_id': lambda data: str(data['_id']),
+        'username': lambda data: data.get('username'),
+        'id_number': lambda data: data.get('id_number'),
+        'birthdate': lambda data: data.get('birthdate'),
+        'role': lambda data: data.get('role', 'user'),
+        'created_at': lambda data: data.get('created_at'),
+    }
+
+    @classmethod
+    def partial_json(cls, data, fields):
+        """Just the requested to_json() fields, read straight from a (projected) stored document"""
+        return {field: cls.JSON_READERS[field](data) for field in fields}
+
     @classmethod
     def from_dict(cls, data):
-        # Handle _id conversion
-        _id = data.get('_id')
-        if _id and not isinstance(_id, ObjectId):
-            try:
-                _id = ObjectId(_id)
-            except:
-                _id = _id  # Keep as string if conversion fails
-        
-        # Handle created_at conversion
+        """Decode a stored user (dict or RawBSONDocument) in one pass; password_hash may be projected out"""
         created_at = data.get('created_at')
-        if created_at and isinstance(created_at, str):
-            try:
-                created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-            except (ValueError, AttributeError):
-                created_at = datetime.utcnow()
-        
-        return cls(
-            username=data['username'],
-            password_hash=data['password_hash'],
-            id_number=data.get('id_number'),
-            birthdate=data.get('birthdate'),
-            role=data.get('role', 'user'),
-            _id=_id,
-            created_at=created_at
+        return cls._build(
+            data['username'],
+            data.get('password_hash'),
+            data.get('id_number'),
+            data.get('birthdate'),
+            data.get('role', 'user'),
+            as_object_id(data.get('_id')) or ObjectId(),
+            parse_datetime(created_at) if created_at else datetime.utcnow()
         )
 
 
-class Appointment:
-    def __init__(self, user_id, date, preferred_time, concern_type, status="Pending", attended=False, _id=None, created_at=None):
+class AppointmentError(Exception):
+    """Base class for appointment update failures that map to client errors"""
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+class AppointmentNotFound(AppointmentError):
+    pass
+
+
+class InvalidStatusTransition(AppointmentError):
+    pass
+
+
+class SlotUnavailable(AppointmentError):
+    pass
+
+
+class Appointment(Model):
+    STATUSES = ('Pending', 'Approved', 'Rejected', 'Cancelled', 'Completed')
+
+    # Current status -> statuses it may be changed to. Pending appointments can
+    # only be approved or rejected; any other status can be changed freely.
+    STATUS_TRANSITIONS = {
+        'Pending': ('Approved', 'Rejected'),
+        'Approved': STATUSES,
+        'Rejected': STATUSES,
+        'Cancelled': STATUSES,
+        'Completed': STATUSES,
+    }
+
+    # created_at is kept as stored (datetime or ISO string) and only parsed,
+    # then formatted for display, the first time a response needs it
+    FIELDS = ('user_id', 'date', 'preferred_time', 'concern_type', 'status', 'attended', '_id', 'slot_start', 'stored_created_at')
+    CACHED = ('_created_at', '_formatted_created_at')
+    __slots__ = FIELDS + CACHED
+
+    def __init__(self, user_id, date, preferred_time, concern_type, status="Pending", attended=False, _id=None, created_at=None, slot_start=None):
         # Convert user_id to ObjectId if it's a valid ObjectId string, otherwise keep as string
-        if user_id and ObjectId.is_valid(user_id):
-            self.user_id = ObjectId(user_id)
-        else:
-            self.user_id = user_id
-            
-        self.date = date
-        self.preferred_time = preferred_time
-        self.concern_type = concern_type
-        self.status = status  # 'Pending', 'Approved', 'Rejected', 'Cancelled', 'Completed'
-        self.attended = attended  # New field to track if user attended
-        self._id = _id or ObjectId()
-        self.created_at = created_at or datetime.utcnow()
+        _set(self, 'user_id', as_object_id(user_id))
+        _set(self, 'date', date)
+        _set(self, 'preferred_time', preferred_time)
+        _set(self, 'concern_type', concern_type)
+        _set(self, 'status', status)  # 'Pending', 'Approved', 'Rejected', 'Cancelled', 'Completed'
+        _set(self, 'attended', attended)  # New field to track if user attended
+        _set(self, '_id', _id or ObjectId())
+        # Typed copy of date + preferred_time, so ranges and sorts use the index
+        _set(self, 'slot_start', slot_start or parse_slot_start(date, preferred_time))
+        _set(self, 'stored_created_at', created_at or datetime.utcnow())
+        _set(self, '_created_at', None)
+        _set(self, '_formatted_created_at', None)
+
+    @property
+    def created_at(self):
+        if self._created_at is None:
+            _set(self, '_created_at', parse_datetime(self.stored_created_at))
+        return self._created_at
+
+    @property
+    def formatted_created_at(self):
+        if self._formatted_created_at is None:
+            _set(self, '_formatted_created_at', format_display_date(self.created_at))
+        return self._formatted_created_at
 
     @staticmethod
     def is_valid_status(status):
         """Validate if status is allowed"""
-        valid_statuses = ['Pending', 'Approved', 'Rejected', 'Cancelled', 'Completed']
-        return status in valid_statuses
+        return status in Appointment.STATUSES
 
     @staticmethod
     def is_admin_updatable_status(status):
         """Validate if status can be set by admin (only Approved or Rejected for pending appointments)"""
-        return status in ['Approved', 'Rejected']
-    
+        return status in Appointment.STATUS_TRANSITIONS['Pending']
+
+    @staticmethod
+    def can_transition(current_status, new_status):
+        return new_status in Appointment.STATUS_TRANSITIONS.get(current_status, ())
+
+    @staticmethod
+    def is_future_date(date_value):
+        """True if a YYYY-MM-DD date is after today (UTC); None if it can't be parsed"""
+        try:
+            appointment_date = datetime.strptime(date_value, '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            return None
+        return appointment_date > datetime.utcnow().date()
+
+    @staticmethod
+    def is_future_slot(slot_start, date_value):
+        """True if the slot is on a later day than today (UTC); None if its date is unreadable"""
+        if slot_start is None:
+            # Not backfilled yet (see `flask backfill-slots`)
+            return Appointment.is_future_date(date_value)
+        return slot_start.date() > datetime.utcnow().date()
+
+    def is_future(self):
+        return Appointment.is_future_slot(self.slot_start, self.date)
+
+    @staticmethod
+    def allowed_source_statuses(new_status):
+        """Statuses an appointment may currently have for new_status to be set"""
+        return [
+            status for status, targets in Appointment.STATUS_TRANSITIONS.items()
+            if new_status in targets
+        ]
+
     def to_dict(self):
-        # Use the actual created_at datetime to generate the formatted string
-        current_created_at = self.created_at
-        if isinstance(current_created_at, str):
-            try:
-                current_created_at = datetime.fromisoformat(current_created_at.replace('Z', '+00:00'))
-            except (ValueError, AttributeError):
-                current_created_at = datetime.utcnow()
-        
-        formatted_created_at = current_created_at.strftime('%B %d, %Y at %I:%M %p')
-        
+        """Document as stored in MongoDB"""
         return {
             'user_id': self.user_id,
             'date': self.date,
@@ -109,40 +304,70 @@ class Appointment:
             'status': self.status,
             'attended': self.attended,
             '_id': self._id,
-            'created_at': current_created_at.isoformat() if isinstance(current_created_at, datetime) else current_created_at,
-            'formatted_created_at': formatted_created_at
+            'slot_start': self.slot_start,
+            'created_at': self.created_at,
+            'formatted_created_at': self.formatted_created_at
         }
 
+    def to_json(self):
+        """API representation: hex IDs and ISO dates, ready for any JSON encoder"""
+        user_id = self.user_id
+        return {
+            'user_id': str(user_id) if isinstance(user_id, ObjectId) else user_id,
+            'date': self.date,
+            'preferred_time': self.preferred_time,
+            'concern_type': self.concern_type,
+            'status': self.status,
+            'attended': self.attended,
+            '_id': str(self._id),
+            'slot_start': self.slot_start.isoformat() if self.slot_start else None,
+            'created_at': self.created_at.isoformat(),
+            'formatted_created_at': self.formatted_created_at
+        }
+
+    # API field -> how to read it from a stored document, for sparse responses
+    JSON_READERS = {
+        '_id': lambda data: data.get('_id'),
+        'user_id': lambda data: data.get('user_id'),
+        'date': lambda data: data.get('date'),
+        'preferred_time': lambda data: data.get('preferred_time'),
+        'concern_type': lambda data: data.get('concern_type'),
+        'status': lambda data: data.get('status') or 'Pending',
+        'attended': lambda data: data.get('attended', False),
+        'slot_start': lambda data: data.get('slot_start'),
+        'created_at': lambda data: parse_datetime(data.get('created_at')),
+        'formatted_created_at': lambda data: data.get('formatted_created_at') or format_display_date(parse_datetime(data.get('created_at'))),
+    }
+
+    @classmethod
+    def partial_json(cls, data, fields):
+        """Just the requested to_json() fields, read straight from a (projected) stored document.
+
+        Skips building a model, which needs fields the client may not have asked for.
+        """
+        return {field: cls.JSON_READERS[field](data) for field in fields}
+
     @classmethod
     def from_dict(cls, data):
-        # Handle _id conversion
-        _id = data.get('_id')
-        if _id and not isinstance(_id, ObjectId):
-            try:
-                _id = ObjectId(_id)
-            except:
-                _id = _id  # Keep as string if conversion fails
-        
-        # Handle user_id conversion - ensure consistency
-        user_id = data.get('user_id')
-        if user_id and ObjectId.is_valid(user_id) and not isinstance(user_id, ObjectId):
-            user_id = ObjectId(user_id)
-        
-        # Handle created_at conversion from string to datetime if needed
-        created_at = data.get('created_at')
-        if created_at and isinstance(created_at, str):
-            try:
-                created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-            except (ValueError, AttributeError):
-                created_at = datetime.utcnow()
-        
-        return cls(
-            user_id=user_id,
-            date=data['date'],
-            preferred_time=data['preferred_time'],
-            concern_type=data['concern_type'],
-            status=data.get('status', 'Pending'),
-            attended=data.get('attended', False),
-            _id=_id,
-            created_at=created_at
-        )
\ No newline at end of file
+        """Decode a stored appointment (dict or RawBSONDocument) in one pass.
+
+        IDs are only converted when stored as strings and created_at is not
+        parsed here, so decoding a canonical document is just field reads.
+        Passing a RawBSONDocument decodes its bytes once, on the first read.
+        """
+        appointment = cls._build(
+            as_object_id(data.get('user_id')),
+            data['date'],
+            data['preferred_time'],
+            data['concern_type'],
+            data.get('status') or 'Pending',
+            data.get('attended', False),
+            as_object_id(data.get('_id')) or ObjectId(),
+            data.get('slot_start'),
+            data.get('created_at') or datetime.utcnow()
+        )
+        # to_dict() stores the display string next to created_at; reuse it rather than reformat
+        formatted_created_at = data.get('formatted_created_at')
+        if formatted_created_at and 'created_at' in data:
+            _set(appointment, '_formatted_created_at', formatted_created_at)
+        return appointment
@@ -0,0 +1,128 @@
+import base64
+from datetime import datetime
+from bson import ObjectId, json_util
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Date-range schedule listings return whole ranges rather than pages
+DEFAULT_RANGE_LIMIT = 500
+MAX_RANGE_LIMIT = 2000
+# Longest from..to span, in days, of the schedule and availability views
+MAX_RANGE_DAYS = 92
+
+# Sort keys shared by the appointment listings. _id is last so every
+# document has a unique position and pages never overlap or skip rows.
+APPOINTMENT_SORT_KEYS = ('date', 'preferred_time', '_id')
+# Types a cursor may carry for each sort key. The values end up inside a
+# query, so anything else (e.g. {'$gt': ''}) would change what it matches.
+CURSOR_TYPES = {
+    'date': (str, type(None)),
+    'preferred_time': (str, type(None)),
+    '_id': (ObjectId, str),
+}
+
+def encode_cursor(document, keys=APPOINTMENT_SORT_KEYS):
+    """Build an opaque cursor token from the sort key values of a document"""
+    values = [document.get(key) for key in keys]
+    # json_util keeps ObjectId and string _ids distinguishable in the token
+    raw = json_util.dumps(values).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token, keys=APPOINTMENT_SORT_KEYS):
+    """Turn a cursor token back into sort key values; raises ValueError if malformed"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json_util.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError('Invalid cursor')
+    if not all(isinstance(value, CURSOR_TYPES[key]) for key, value in zip(keys, values)):
+        raise ValueError('Invalid cursor')
+    return values
+
+def _after(value, descending):
+    """Condition for values sorting strictly after value; None if nothing can.
+
+    Null and missing values sort before strings, and {'$gt': None} or
+    {'$lt': 'x'} would never match them, so they are handled explicitly.
+    """
+    if value is None:
+        return None if descending else {'$ne': None}
+    if descending:
+        # $lt alone would skip the nulls that follow every string
+        return {'$not': {'$gte': value}}
+    return {'$gt': value}
+
+def keyset_filter(values, keys=APPOINTMENT_SORT_KEYS, descending=False):
+    """Match documents strictly after the given sort position.
+
+    For keys (a, b, c) this is a > A or (a = A and b > B) or
+    (a = A and b = B and c > C), with "before" instead of "after" for
+    descending sorts, which the compound index on the same keys can answer
+    directly. Equality on None matches both null and missing values, as
+    the sort treats them alike.
+    """
+    clauses = []
+    for position, key in enumerate(keys):
+        condition = _after(values[position], descending)
+        if condition is None:
+            continue
+        clause = {keys[i]: values[i] for i in range(position)}
+        clause[key] = condition
+        clauses.append(clause)
+    return {'$or': clauses}
+
+def sort_spec(keys=APPOINTMENT_SORT_KEYS, descending=False):
+    direction = -1 if descending else 1
+    return [(key, direction) for key in keys]
+
+def parse_limit(args, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Read ?limit=; raises ValueError with a client-facing message when it is invalid"""
+    limit = args.get('limit', default)
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer')
+    if limit < 1 or limit > maximum:
+        raise ValueError(f'limit must be between 1 and {maximum}')
+    return limit
+
+def parse_date(value, name):
+    """datetime for a YYYY-MM-DD request value; raises ValueError with a client-facing message"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a date in YYYY-MM-DD format')
+
+def parse_date_range(date_from, date_to, required=False, max_days=None):
+    """(start, end) datetimes for inclusive ?from=&to= dates; either is None when not given.
+
+    Raises ValueError with a client-facing message when a date is missing
+    (if required) or invalid, when from is after to, or when the range
+    spans max_days or more.
+    """
+    if required and not (date_from and date_to):
+        raise ValueError('from and to are required')
+    start = parse_date(date_from, 'from') if date_from else None
+    end = parse_date(date_to, 'to') if date_to else None
+    if start and end and start > end:
+        raise ValueError('from must not be after to')
+    if max_days and start and end and (end - start).days >= max_days:
+        raise ValueError(f'range must not exceed {max_days} days')
+    return start, end
+
+def parse_page_args(args):
+    """Read limit/after/all from request args.
+
+    Returns (unpaginated, limit, after_values). Raises ValueError with a
+    client-facing message when the arguments are invalid.
+    """
+    unpaginated = args.get('all', '').lower() in ('1', 'true', 'yes')
+    if unpaginated:
+        return True, None, None
+
+    limit = parse_limit(args)
+    after = args.get('after')
+    after_values = decode_cursor(after) if after else None
+    return False, limit, after_values
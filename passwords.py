@@ -0,0 +1,110 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import bcrypt
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROUNDS = 12
+DEFAULT_MAX_QUEUE = 32
+
+class PasswordPoolBusy(Exception):
+    """Too much password work is already queued; callers should answer 503"""
+    pass
+
+def hash_password(password, rounds=DEFAULT_ROUNDS):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+def verify_password(password, password_hash):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+def hash_rounds(password_hash):
+    """Cost factor of a bcrypt hash such as '$2b$12$...'; None if it can't be read"""
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def is_bcrypt_hash(password_hash):
+    """True for a string shaped like a bcrypt hash ('$2b$12$' + 53 characters)"""
+    return (
+        isinstance(password_hash, str) and len(password_hash) == 60
+        and password_hash[:4] in ('$2a$', '$2b$', '$2y$') and hash_rounds(password_hash) is not None
+    )
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded thread pool.
+
+    bcrypt releases the GIL while it works, so the pool spreads hashing over
+    the CPU cores while request threads (and /health) keep running. At most
+    `workers + max_queue` calls may be in flight; beyond that PasswordPoolBusy
+    is raised at once instead of letting requests pile up behind the pool.
+    """
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=None, max_queue=DEFAULT_MAX_QUEUE):
+        self.rounds = rounds
+        self.workers = workers or os.cpu_count() or 2
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._executor = None
+
+    def configure(self, rounds=None, workers=None, max_queue=None):
+        if rounds is not None:
+            self.rounds = rounds
+        if workers:
+            self.workers = workers
+        if max_queue is not None:
+            self.max_queue = max_queue
+        self.after_fork()
+
+    def after_fork(self):
+        """Forget pool threads inherited from the parent process; a new pool starts on first use"""
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._executor = None
+
+    def _run(self, function, *args):
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                raise PasswordPoolBusy("Too many password operations in progress")
+            self._in_flight += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+            executor = self._executor
+        try:
+            return executor.submit(function, *args).result()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def hash(self, password):
+        return self._run(hash_password, password, self.rounds)
+
+    def verify(self, password, password_hash):
+        return self._run(verify_password, password, password_hash)
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with a different cost than the configured one"""
+        rounds = hash_rounds(password_hash)
+        return rounds is not None and rounds != self.rounds
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rounds': self.rounds,
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'in_flight': self._in_flight,
+            }
+
+hasher = PasswordHasher()
+
+def init_app(app):
+    """Read BCRYPT_ROUNDS / PASSWORD_WORKERS / PASSWORD_MAX_QUEUE from the app config"""
+    hasher.configure(
+        rounds=app.config.get('BCRYPT_ROUNDS'),
+        workers=app.config.get('PASSWORD_WORKERS'),
+        max_queue=app.config.get('PASSWORD_MAX_QUEUE')
+    )
@@ -1,8 +1,41 @@
+import io
+import logging
 from flask import jsonify, request
-from database import find_user_by_username, find_user_by_id_number, insert_user, insert_appointment, find_appointments_by_user_id, update_appointment_status, get_all_appointments, find_user_by_id, find_appointment_by_id, get_appointments_with_user_details, update_appointment_attended
-from models import User, Appointment
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from database import find_user_by_username, insert_user, duplicate_key_field, update_appointment_status, find_appointment_by_id, get_appointments_with_user_details, update_appointment_attended, get_appointments_page_with_user_details, iter_appointments_with_user_details, batch_update_appointments, MAX_BATCH_OPERATIONS, find_appointment_documents_by_user_id, find_user_profile_document, watch_appointments, appointment_change_event, update_password_hash, find_appointments_in_range, book_appointment, slot_availability, appointment_statistics
+from pagination import parse_page_args, parse_limit, parse_date_range, DEFAULT_RANGE_LIMIT, MAX_RANGE_LIMIT, MAX_RANGE_DAYS
+from etags import raw_etag, is_not_modified, not_modified, tag
+from fieldsets import parse_fields, APPOINTMENT_FIELDS, LISTING_FIELDS, USER_FIELDS
+from streaming import parse_stream_args, json_stream_response, parse_appointment_filters, change_feed_response, feed_slots, DEFAULT_SSE_HEARTBEAT_SECONDS, SSE_RETRY_MS
+from models import User, Appointment, AppointmentNotFound, InvalidStatusTransition, SlotUnavailable
+import availability
+import stats
+from passwords import PasswordPoolBusy
+from importer import import_records, guess_format, KINDS, FORMATS
 from bson import ObjectId
-from datetime import datetime
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+# Seconds clients are told to wait when the password pool is saturated
+PASSWORD_RETRY_AFTER = 1
+
+def _password_pool_busy(message, error):
+    logger.warning("⚠️ %s: %s", message, error)
+    response = jsonify({
+        'message': message,
+        'error': 'Server is busy, please try again'
+    })
+    response.headers['Retry-After'] = str(PASSWORD_RETRY_AFTER)
+    return response, 503
+
+def _rehash_password(user, password):
+    """Upgrade a hash made at an outdated cost; login still succeeds if this fails"""
+    try:
+        if update_password_hash(user._id, user.password_hash, User.set_password(password)):
+            logger.info("🔐 Rehashed password for %s at the current cost", user.username)
+    except PasswordPoolBusy:
+        logger.debug("🔐 Password pool busy; rehash for %s deferred to a later login", user.username)
 
 def init_routes(app):
     @app.route('/')
@@ -23,13 +56,13 @@ def init_routes(app):
     @app.route('/register', methods=['POST'])
     def register():
         try:
-            print("🚀 REGISTER ENDPOINT CALLED")
+            logger.debug("🚀 REGISTER ENDPOINT CALLED")
             data = request.get_json()
-            print(f"📦 Received registration data: {data}")
+            logger.debug("📦 Received registration for username: %s", (data or {}).get('username'))
             
             # Validate required fields
             if not data:
-                print("❌ No JSON data provided")
+                logger.info("❌ No JSON data provided")
                 return jsonify({
                     'message': 'Invalid request data',
                     'error': 'No JSON data provided'
@@ -39,40 +72,22 @@ def init_routes(app):
             missing_fields = [field for field in required_fields if not data.get(field)]
             
             if missing_fields:
-                print(f"❌ Missing fields: {missing_fields}")
+                logger.info("❌ Missing fields: %s", missing_fields)
                 return jsonify({
                     'message': 'Missing required fields',
                     'error': f'Missing fields: {", ".join(missing_fields)}',
                     'missing_fields': missing_fields
                 }), 400
             
-            print(f"🔍 Checking if username exists: {data['username']}")
-            # Check if user already exists
-            if find_user_by_username(data['username']):
-                print(f"❌ Username already exists: {data['username']}")
-                return jsonify({
-                    'message': 'Registration failed',
-                    'error': 'Username already exists'
-                }), 409
-            
-            print(f"🔍 Checking if ID number exists: {data['id_number']}")
-            # Check if ID number already exists
-            if find_user_by_id_number(data['id_number']):
-                print(f"❌ ID number already exists: {data['id_number']}")
-                return jsonify({
-                    'message': 'Registration failed', 
-                    'error': 'ID number already registered'
-                }), 409
-            
             # Validate password length
             if len(data['password']) < 6:
-                print(f"❌ Password too short: {len(data['password'])} characters")
+                logger.info("❌ Password too short: %s characters", len(data['password']))
                 return jsonify({
                     'message': 'Registration failed',
                     'error': 'Password must be at least 6 characters long'
                 }), 400
             
-            print("✅ All validations passed, creating user...")
+            logger.debug("✅ All validations passed, creating user...")
             # Create new user with default role 'user'
             password_hash = User.set_password(data['password'])
             user = User(
@@ -83,17 +98,26 @@ def init_routes(app):
                 role=data.get('role', 'user')  # Default role is 'user'
             )
             
-            print(f"👤 User object created: {user.username}")
+            logger.debug("👤 User object created: %s", user.username)
             
-            # Save user to database
-            result = insert_user(user)
-            print(f"💾 Database insertion result: {result}")
+            # Save user to database; the unique indexes reject duplicates in the same round trip
+            try:
+                result = insert_user(user)
+            except DuplicateKeyError as e:
+                field = duplicate_key_field(e)
+                logger.info("❌ Duplicate %s on registration: %s", field, data.get(field))
+                error = 'ID number already registered' if field == 'id_number' else 'Username already exists'
+                return jsonify({
+                    'message': 'Registration failed',
+                    'error': error
+                }), 409
+            logger.debug("💾 Database insertion result: %s", result)
             
             if result:
-                print(f"✅ User registered successfully: {user.username}")
+                logger.info("✅ User registered successfully: %s", user.username)
                 return jsonify({
                     'message': 'Registration successful! Please login.',
-                    'user_id': str(user._id),
+                    'user_id': user._id,
                     'user': {
                         'username': user.username,
                         'id_number': user.id_number,
@@ -102,16 +126,16 @@ def init_routes(app):
                     }
                 }), 201
             else:
-                print("❌ Failed to insert user into database")
+                logger.error("❌ Failed to insert user into database")
                 return jsonify({
                     'message': 'Registration failed',
                     'error': 'Failed to create user in database'
                 }), 500
             
+        except PasswordPoolBusy as e:
+            return _password_pool_busy('Registration failed', e)
         except Exception as e:
-            print(f"💥 Registration error: {str(e)}")
-            import traceback
-            print(f"🔍 Stack trace: {traceback.format_exc()}")
+            logger.exception("💥 Registration error: %s", str(e))
             return jsonify({
                 'message': 'Registration error',
                 'error': str(e)
@@ -135,7 +159,10 @@ def init_routes(app):
                     'error': 'Invalid username or password'
                 }), 401
             
-            print(f"✅ User {user.username} logged in successfully. Role: {user.role}")
+            if user.needs_rehash():
+                _rehash_password(user, data['password'])
+            
+            logger.info("✅ User %s logged in successfully. Role: %s", user.username, user.role)
             
             return jsonify({
                 'message': 'Login successful',
@@ -143,13 +170,15 @@ def init_routes(app):
                     'username': user.username,
                     'id_number': user.id_number,
                     'birthdate': user.birthdate,
-                    'user_id': str(user._id),
+                    'user_id': user._id,
                     'role': user.role
                 }
             }), 200
             
+        except PasswordPoolBusy as e:
+            return _password_pool_busy('Login failed', e)
         except Exception as e:
-            print(f"❌ Login error: {e}")
+            logger.error("❌ Login error: %s", e)
             return jsonify({
                 'message': 'Login error',
                 'error': str(e)
@@ -177,24 +206,40 @@ def init_routes(app):
                     'missing_fields': missing_fields
                 }), 400
             
-            # Create new appointment with default status 'Pending' (not approved)
+            # Only slots /availability offers can be booked
+            try:
+                slot_start = availability.bookable_slot_start(data['date'], data['preferred_time'])
+            except ValueError as e:
+                return jsonify({
+                    'message': 'Appointment scheduling failed',
+                    'error': str(e)
+                }), 400
+            
+            # New appointments always start out Pending; any status sent by the client is ignored
             appointment = Appointment(
                 user_id=data['user_id'],
                 date=data['date'],
                 preferred_time=data['preferred_time'],
                 concern_type=data['concern_type'],
-                status=data.get('status', 'Pending')  # Default status is 'Pending'
+                status='Pending',
+                slot_start=slot_start
             )
             
-            # Save appointment to database
-            result = insert_appointment(appointment)
+            # Reserve the slot and save the appointment; a full slot is rejected before any write
+            try:
+                result = book_appointment(appointment)
+            except SlotUnavailable as e:
+                return jsonify({
+                    'message': 'Appointment scheduling failed',
+                    'error': e.message
+                }), 409
             
             if result:
-                print(f"✅ Appointment created for user {data['user_id']} on {data['date']} at {data['preferred_time']}")
+                logger.info("✅ Appointment created for user %s on %s at %s", data['user_id'], data['date'], data['preferred_time'])
                 return jsonify({
                     'message': 'Appointment scheduled successfully! Waiting for approval.',
-                    'appointment_id': str(appointment._id),
-                    'appointment': appointment.to_dict()
+                    'appointment_id': appointment._id,
+                    'appointment': appointment
                 }), 201
             else:
                 return jsonify({
@@ -203,26 +248,136 @@ def init_routes(app):
                 }), 500
             
         except Exception as e:
-            print(f"❌ Appointment scheduling error: {e}")
+            logger.error("❌ Appointment scheduling error: %s", e)
             return jsonify({
                 'message': 'Appointment scheduling error',
                 'error': str(e)
             }), 500
 
+    @app.route('/appointments', methods=['GET'])
+    def get_appointments_in_range():
+        """Schedule view: appointments whose slot falls between from and to (inclusive dates)"""
+        try:
+            try:
+                statuses, date_from, date_to = parse_appointment_filters(request.args)
+                start, end = parse_date_range(date_from, date_to, required=True, max_days=MAX_RANGE_DAYS)
+                limit = parse_limit(request.args, default=DEFAULT_RANGE_LIMIT, maximum=MAX_RANGE_LIMIT)
+            except ValueError as e:
+                return jsonify({
+                    'message': 'Invalid filter parameters',
+                    'error': str(e)
+                }), 400
+            
+            appointments, truncated = find_appointments_in_range(start, end + timedelta(days=1), statuses, limit)
+            return jsonify({
+                'message': 'Appointments retrieved successfully',
+                'appointments': appointments,
+                'count': len(appointments),
+                'limit': limit,
+                'truncated': truncated
+            }), 200
+            
+        except Exception as e:
+            logger.error("❌ Error retrieving appointments by date range: %s", e)
+            return jsonify({
+                'message': 'Error retrieving appointments',
+                'error': str(e)
+            }), 500
+
+    @app.route('/availability', methods=['GET'])
+    def get_availability():
+        """Free places per slot for each day from..to (inclusive), read from the occupancy counters"""
+        try:
+            start, end = parse_date_range(request.args.get('from'), request.args.get('to'), required=True, max_days=MAX_RANGE_DAYS)
+        except ValueError as e:
+            return jsonify({
+                'message': 'Invalid date range',
+                'error': str(e)
+            }), 400
+        
+        try:
+            return jsonify({
+                'message': 'Availability retrieved successfully',
+                'capacity': availability.capacity(),
+                'days': slot_availability(start, end)
+            }), 200
+        except Exception as e:
+            logger.error("❌ Error retrieving availability: %s", e)
+            return jsonify({
+                'message': 'Error retrieving availability',
+                'error': str(e)
+            }), 500
+
+    @app.route('/stats', methods=['GET'])
+    def get_statistics():
+        """Counts by status and concern type with attendance/no-show rates, read from the counters.
+
+        ?from=YYYY-MM&to=YYYY-MM adds a per-month breakdown for reporting.
+        """
+        try:
+            month_from, month_to = stats.parse_months(request.args.get('from'), request.args.get('to'))
+        except ValueError as e:
+            return jsonify({
+                'message': 'Invalid month range',
+                'error': str(e)
+            }), 400
+        
+        try:
+            summary, months = appointment_statistics(month_from, month_to)
+            response = {
+                'message': 'Statistics retrieved successfully',
+                'summary': summary
+            }
+            if months is not None:
+                response['months'] = months
+            return jsonify(response), 200
+        except Exception as e:
+            logger.error("❌ Error retrieving statistics: %s", e)
+            return jsonify({
+                'message': 'Error retrieving statistics',
+                'error': str(e)
+            }), 500
+
     @app.route('/appointments/<user_id>', methods=['GET'])
     def get_user_appointments(user_id):
         try:
-            appointments = find_appointments_by_user_id(user_id)
+            try:
+                unpaginated, limit, after = parse_page_args(request.args)
+            except ValueError as e:
+                return jsonify({
+                    'message': 'Invalid pagination parameters',
+                    'error': str(e)
+                }), 400
+            try:
+                fields = parse_fields(request.args, APPOINTMENT_FIELDS)
+            except ValueError as e:
+                return jsonify({
+                    'message': 'Invalid fields parameter',
+                    'error': str(e)
+                }), 400
             
-            print(f"✅ Retrieved {len(appointments)} appointments for user {user_id}")
+            documents, next_cursor = find_appointment_documents_by_user_id(user_id, limit, after, fields)
+            etag = raw_etag(documents, limit, next_cursor, fields)
+            if is_not_modified(etag):
+                return not_modified(etag)
             
-            return jsonify({
+            logger.debug("✅ Retrieved %s appointments for user %s", len(documents), user_id)
+            
+            if fields:
+                appointments = [Appointment.partial_json(document, fields) for document in documents]
+            else:
+                appointments = [Appointment.from_dict(document) for document in documents]
+            response = {
                 'message': 'Appointments retrieved successfully',
-                'appointments': [appointment.to_dict() for appointment in appointments]
-            }), 200
+                'appointments': appointments
+            }
+            if not unpaginated:
+                response['next_cursor'] = next_cursor
+                response['limit'] = limit
+            return tag(jsonify(response), etag), 200
             
         except Exception as e:
-            print(f"❌ Error retrieving appointments: {e}")
+            logger.error("❌ Error retrieving appointments: %s", e)
             return jsonify({
                 'message': 'Error retrieving appointments',
                 'error': str(e)
@@ -239,33 +394,128 @@ def init_routes(app):
                 }), 400
             
             # Validate status
-            valid_statuses = ['Pending', 'Approved', 'Rejected', 'Cancelled', 'Completed']
-            if data['status'] not in valid_statuses:
+            if not Appointment.is_valid_status(data['status']):
                 return jsonify({
-                    'message': f'Status must be one of: {", ".join(valid_statuses)}'
+                    'message': f'Status must be one of: {", ".join(Appointment.STATUSES)}'
                 }), 400
             
-            # Update the status
-            success, message = update_appointment_status(appointment_id, data['status'])
-            
-            if success:
+            # Check and update in one round trip
+            try:
+                appointment, message = update_appointment_status(appointment_id, data['status'])
+            except AppointmentNotFound as e:
                 return jsonify({
-                    'message': f'Appointment status updated to {data["status"]}',
-                    'status': data['status']
-                }), 200
-            else:
+                    'message': 'Failed to update appointment status',
+                    'error': e.message
+                }), 404
+            except InvalidStatusTransition as e:
                 return jsonify({
                     'message': 'Failed to update appointment status',
-                    'error': message
+                    'error': e.message
                 }), 400
+            except SlotUnavailable as e:
+                return jsonify({
+                    'message': 'Failed to update appointment status',
+                    'error': e.message
+                }), 409
+            
+            return jsonify({
+                'message': f'Appointment status updated to {data["status"]}',
+                'status': data['status'],
+                'detail': message,
+                'appointment': appointment
+            }), 200
                 
         except Exception as e:
-            print(f"❌ Error updating appointment status: {e}")
+            logger.error("❌ Error updating appointment status: %s", e)
             return jsonify({
                 'message': 'Error updating appointment status',
                 'error': str(e)
             }), 500
 
+    @app.route('/appointments/batch', methods=['PUT'])
+    def batch_update_appointments_route():
+        try:
+            data = request.get_json()
+            operations = data.get('operations') if isinstance(data, dict) else None
+            
+            if not isinstance(operations, list) or not operations:
+                return jsonify({
+                    'message': 'operations is required',
+                    'error': 'Provide a non-empty list of {id, status?, attended?} objects'
+                }), 400
+            
+            if len(operations) > MAX_BATCH_OPERATIONS:
+                return jsonify({
+                    'message': 'Too many operations',
+                    'error': f'At most {MAX_BATCH_OPERATIONS} operations per batch'
+                }), 400
+            
+            if not all(isinstance(operation, dict) for operation in operations):
+                return jsonify({
+                    'message': 'Invalid operations',
+                    'error': 'Each operation must be an object'
+                }), 400
+            
+            results = batch_update_appointments(operations)
+            succeeded = sum(1 for item in results if item['success'])
+            
+            return jsonify({
+                'message': f'{succeeded} of {len(results)} appointments updated',
+                'succeeded': succeeded,
+                'failed': len(results) - succeeded,
+                'results': results
+            }), 200
+            
+        except Exception as e:
+            logger.exception("❌ Error in batch appointment update: %s", e)
+            return jsonify({
+                'message': 'Error updating appointments',
+                'error': str(e)
+            }), 500
+
+    @app.route('/import/<kind>', methods=['POST'])
+    def import_records_route(kind):
+        try:
+            if kind not in KINDS:
+                return jsonify({
+                    'message': 'Unknown import type',
+                    'error': f'Import type must be one of: {", ".join(KINDS)}'
+                }), 404
+            
+            # Either a multipart upload named "file" or the raw request body
+            upload = request.files.get('file')
+            if upload:
+                raw_stream = upload.stream
+                file_format = request.args.get('format') or guess_format(upload.filename)
+            else:
+                raw_stream = request.stream
+                file_format = request.args.get('format')
+                if not file_format and request.mimetype == 'text/csv':
+                    file_format = 'csv'
+                elif not file_format and request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+                    file_format = 'jsonl'
+            
+            if file_format not in FORMATS:
+                return jsonify({
+                    'message': 'Unknown file format',
+                    'error': f'Pass ?format= one of: {", ".join(FORMATS)}'
+                }), 400
+            
+            stream = io.TextIOWrapper(raw_stream, encoding='utf-8', newline='')
+            report = import_records(kind, stream, file_format)
+            
+            return jsonify({
+                'message': f'{report["inserted"]} of {report["rows"]} {kind} imported',
+                **report
+            }), 200
+            
+        except Exception as e:
+            logger.exception("❌ Import error: %s", e)
+            return jsonify({
+                'message': 'Import error',
+                'error': str(e)
+            }), 500
+
     @app.route('/appointments/<appointment_id>/attended', methods=['PUT'])
     def mark_appointment_attended(appointment_id):
         try:
@@ -297,24 +547,16 @@ def init_routes(app):
                     'error': error_msg
                 }), 404
             
-            # Check if the appointment is in the past or today
-            from datetime import datetime, date
-            
-            # Parse appointment date (assuming format YYYY-MM-DD)
-            try:
-                appointment_date = datetime.strptime(appointment.date, '%Y-%m-%d').date()
-                current_date = datetime.utcnow().date()
-                
-                # Only allow marking attendance for past or current date appointments
-                if appointment_date > current_date:
-                    return jsonify({
-                        'message': 'Cannot mark attendance for future appointments',
-                        'error': 'Appointment date is in the future'
-                    }), 400
-                    
-            except ValueError:
+            # Only allow marking attendance for past or current date appointments
+            is_future = appointment.is_future()
+            if is_future:
+                return jsonify({
+                    'message': 'Cannot mark attendance for future appointments',
+                    'error': 'Appointment date is in the future'
+                }), 400
+            if is_future is None:
                 # If date parsing fails, proceed anyway (might be different format)
-                print("Warning: Could not parse appointment date for validation")
+                logger.warning("Warning: Could not parse appointment date for validation")
             
             # REMOVED: No longer checking appointment status - allow any status for today's appointments
             
@@ -334,7 +576,7 @@ def init_routes(app):
                 }), 400
                 
         except Exception as e:
-            print(f"❌ Error updating attendance status: {e}")
+            logger.error("❌ Error updating attendance status: %s", e)
             return jsonify({
                 'message': 'Error updating attendance status',
                 'error': str(e)
@@ -344,45 +586,128 @@ def init_routes(app):
     @app.route('/all-appointments', methods=['GET'])
     def get_all_appointments_route():
         try:
-            appointments = get_appointments_with_user_details()
+            try:
+                unpaginated, limit, after = parse_page_args(request.args)
+                stream, batch_size = parse_stream_args(request.args)
+            except ValueError as e:
+                return jsonify({
+                    'message': 'Invalid pagination parameters',
+                    'error': str(e)
+                }), 400
+            try:
+                fields = parse_fields(request.args, LISTING_FIELDS)
+            except ValueError as e:
+                return jsonify({
+                    'message': 'Invalid fields parameter',
+                    'error': str(e)
+                }), 400
             
+            # ?stream=true sends the whole collection incrementally
+            if stream:
+                return json_stream_response(
+                    iter_appointments_with_user_details(batch_size, fields),
+                    'appointments',
+                    message='All appointments retrieved successfully'
+                )
+            
+            # ?all=true keeps the original single-response shape
+            if unpaginated:
+                appointments = get_appointments_with_user_details(fields)
+                return jsonify({
+                    'message': 'All appointments retrieved successfully',
+                    'appointments': appointments
+                }), 200
+            
+            appointments, next_cursor = get_appointments_page_with_user_details(limit, after, fields)
             return jsonify({
                 'message': 'All appointments retrieved successfully',
-                'appointments': appointments
+                'appointments': appointments,
+                'next_cursor': next_cursor,
+                'limit': limit
             }), 200
             
         except Exception as e:
-            print(f"❌ Error retrieving all appointments: {e}")
+            logger.error("❌ Error retrieving all appointments: %s", e)
             return jsonify({
                 'message': 'Error retrieving appointments',
                 'error': str(e)
             }), 500
 
+    @app.route('/appointments/stream', methods=['GET'])
+    def appointment_change_stream():
+        """Server-Sent Events feed of appointment inserts, updates and deletes"""
+        try:
+            statuses, date_from, date_to = parse_appointment_filters(request.args)
+        except ValueError as e:
+            return jsonify({
+                'message': 'Invalid filter parameters',
+                'error': str(e)
+            }), 400
+        
+        # Each feed holds a worker thread for up to SSE_MAX_DURATION; keep the rest for the API
+        if not feed_slots.acquire():
+            logger.warning("⚠️ Change feed refused: %s streams already open in this worker", feed_slots.limit)
+            response = jsonify({
+                'message': 'Live updates are busy',
+                'error': 'Too many open live update streams, please try again'
+            })
+            response.headers['Retry-After'] = str(max(1, SSE_RETRY_MS // 1000))
+            return response, 503
+        
+        # EventSource sends Last-Event-ID on reconnect; the query arg is for clients that can't set headers
+        resume_token = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        heartbeat_seconds = app.config.get('SSE_HEARTBEAT_SECONDS', DEFAULT_SSE_HEARTBEAT_SECONDS)
+        try:
+            change_stream, reset = watch_appointments(
+                statuses, date_from, date_to,
+                resume_token=resume_token,
+                max_await_ms=int(heartbeat_seconds * 1000)
+            )
+        except PyMongoError as e:
+            # No replica set (OperationFailure), server selection timeouts, network errors
+            feed_slots.release()
+            logger.error("❌ Cannot open appointment change stream: %s", e)
+            return jsonify({
+                'message': 'Live updates are not available',
+                'error': str(e)
+            }), 503
+        except Exception:
+            feed_slots.release()
+            raise
+        
+        logger.debug("📡 Change feed opened (status=%s, from=%s, to=%s, resumed=%s)", statuses, date_from, date_to, bool(resume_token) and not reset)
+        return change_feed_response(change_stream, appointment_change_event, reset=reset, on_close=feed_slots.release)
+
     # New endpoint to get user profile with role information
     @app.route('/user/<user_id>', methods=['GET'])
     def get_user_profile(user_id):
         try:
-            user = find_user_by_id(user_id)
-            if not user:
+            try:
+                fields = parse_fields(request.args, USER_FIELDS)
+            except ValueError as e:
+                return jsonify({
+                    'message': 'Invalid fields parameter',
+                    'error': str(e)
+                }), 400
+            
+            document = find_user_profile_document(user_id, fields)
+            if document is None:
                 return jsonify({
                     'message': 'User not found',
                     'error': 'Invalid user ID'
                 }), 404
             
-            return jsonify({
+            etag = raw_etag([document], fields)
+            if is_not_modified(etag):
+                return not_modified(etag)
+            
+            return tag(jsonify({
                 'message': 'User profile retrieved successfully',
-                'user': {
-                    'username': user.username,
-                    'id_number': user.id_number,
-                    'birthdate': user.birthdate,
-                    'user_id': str(user._id),
-                    'role': user.role,
-                    'created_at': user.created_at.isoformat() if hasattr(user.created_at, 'isoformat') else user.created_at
-                }
-            }), 200
+                'user': User.partial_json(document, fields) if fields else User.from_dict(document)
+            }), etag), 200
             
         except Exception as e:
-            print(f"❌ Error retrieving user profile: {e}")
+            logger.error("❌ Error retrieving user profile: %s", e)
             return jsonify({
                 'message': 'Error retrieving user profile',
                 'error': str(e)
@@ -404,21 +729,30 @@ def init_routes(app):
 
     @app.route('/health')
     def health_check():
+        import health
+        # Liveness stays 200; database state comes from the background monitor
         return jsonify({
             'status': 'healthy',
-            'message': 'API is running'
+            'message': 'API is running',
+            'database': health.monitor.state()
         })
 
     # Test endpoint to check if appointments collection exists
     @app.route('/test-appointments')
     def test_appointments():
         try:
-            from database import mongo
-            # Try to access appointments collection
-            appointments_count = mongo.db.appointments.count_documents({})
+            import health
+            # Served from the background health check; no query per probe
+            state = health.monitor.state()
+            if not state['ok']:
+                return jsonify({
+                    'message': 'Error accessing appointments collection',
+                    'error': state['last_error']
+                }), 500
             return jsonify({
                 'message': 'Appointments collection is accessible',
-                'appointments_count': appointments_count
+                'appointments_count': state['appointments_count'],
+                'last_checked': state['last_checked']
             })
         except Exception as e:
             return jsonify({
@@ -439,7 +773,7 @@ def init_routes(app):
             if appointment:
                 return jsonify({
                     'found': True,
-                    'appointment': appointment.to_dict(),
+                    'appointment': appointment,
                     'raw_id': appointment_id,
                     'is_valid_objectid': ObjectId.is_valid(appointment_id)
                 }), 200
@@ -456,17 +790,29 @@ def init_routes(app):
                 'raw_id': appointment_id
             }), 500
 
+    # Debug endpoint exposing lookup-miss counters
+    @app.route('/debug/diagnostics')
+    def debug_diagnostics():
+        import diagnostics
+        from cache import appointments_cache
+        from passwords import hasher
+        return jsonify(dict(
+            diagnostics.snapshot(),
+            appointments_cache=appointments_cache.stats(),
+            change_feeds=feed_slots.stats(),
+            password_pool=hasher.stats()
+        )), 200
+
     # Debug endpoint to list all appointments
     @app.route('/debug/all-appointments-raw')
     def debug_all_appointments_raw():
         try:
-            from database import mongo
-            appointments = list(mongo.db.appointments.find())
+            from database import list_collection
+            stream, batch_size = parse_stream_args(request.args)
             
-            serialized_appointments = []
-            for apt in appointments:
-                serialized_apt = {
-                    '_id': str(apt['_id']),
+            def serialize(apt):
+                return {
+                    '_id': apt['_id'],
                     'user_id': apt.get('user_id', 'N/A'),
                     'date': apt.get('date', 'N/A'),
                     'status': apt.get('status', 'N/A'),
@@ -475,12 +821,19 @@ def init_routes(app):
                     'attended': apt.get('attended', 'N/A'),
                     'created_at': apt.get('created_at', 'N/A')
                 }
-                serialized_appointments.append(serialized_apt)
+            
+            cursor = list_collection('appointments').find().batch_size(batch_size)
+            if stream:
+                return json_stream_response((serialize(apt) for apt in cursor), 'appointments')
+            
+            serialized_appointments = [serialize(apt) for apt in cursor]
             
             return jsonify({
                 'appointments': serialized_appointments,
                 'count': len(serialized_appointments)
             }), 200
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
@@ -488,23 +841,30 @@ def init_routes(app):
     @app.route('/debug/users')
     def debug_users():
         try:
-            from database import mongo
-            users = list(mongo.db.users.find())
+            from database import list_collection
+            stream, batch_size = parse_stream_args(request.args)
             
-            serialized_users = []
-            for user in users:
-                serialized_user = {
-                    '_id': str(user['_id']),
+            def serialize(user):
+                return {
+                    '_id': user['_id'],
                     'username': user.get('username', 'N/A'),
                     'id_number': user.get('id_number', 'N/A'),
                     'role': user.get('role', 'N/A')
                 }
-                serialized_users.append(serialized_user)
+            
+            # Never read password hashes for a debug listing
+            cursor = list_collection('users').find({}, {'password_hash': 0}).batch_size(batch_size)
+            if stream:
+                return json_stream_response((serialize(user) for user in cursor), 'users')
+            
+            serialized_users = [serialize(user) for user in cursor]
             
             return jsonify({
                 'users': serialized_users,
                 'count': len(serialized_users)
             }), 200
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
@@ -512,13 +872,12 @@ def init_routes(app):
     @app.route('/debug/admin-appointments', methods=['GET'])
     def debug_admin_appointments():
         try:
-            from database import mongo
-            appointments = list(mongo.db.appointments.find())
+            from database import list_collection
+            stream, batch_size = parse_stream_args(request.args)
             
-            serialized_appointments = []
-            for apt in appointments:
-                serialized_apt = {
-                    '_id': str(apt['_id']),
+            def serialize(apt):
+                return {
+                    '_id': apt['_id'],
                     'user_id': apt.get('user_id', 'N/A'),
                     'date': apt.get('date', 'N/A'),
                     'status': apt.get('status', 'N/A'),
@@ -526,11 +885,18 @@ def init_routes(app):
                     'preferred_time': apt.get('preferred_time', 'N/A'),
                     'attended': apt.get('attended', False)
                 }
-                serialized_appointments.append(serialized_apt)
+            
+            cursor = list_collection('appointments').find().batch_size(batch_size)
+            if stream:
+                return json_stream_response((serialize(apt) for apt in cursor), 'appointments')
+            
+            serialized_appointments = [serialize(apt) for apt in cursor]
             
             return jsonify({
                 'appointments': serialized_appointments,
                 'count': len(serialized_appointments)
             }), 200
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             return jsonify({'error': str(e)}), 500
\ No newline at end of file
@@ -0,0 +1,218 @@
+import logging
+from collections import defaultdict
+from datetime import datetime
+from pymongo import ReplaceOne, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Counters live in one document per month of the appointment slot, plus a
+# running total:
+#   {'_id': '2026-03', 'total': 40,
+#    'status': {'Pending': 5, 'Approved': 20, ...},
+#    'concern_type': {'Academic': 25, 'Personal': 15},
+#    'attended': {'Approved': 12, 'Completed': 6},   # attended, by status
+#    'expected_slots': {'02 09:00': 3, ...}}         # Approved/Completed, by slot start
+# The total lives under ALL_KEY; appointments without a slot_start (not
+# backfilled yet) are counted under UNDATED_KEY. Every write path $incs the
+# month document and the total together, so the dashboard summary is one
+# read and a monthly report is one _id range read.
+# Counters can't see time pass, so a booking is only expected to be
+# attended once its slot has started: reads subtract the expected_slots
+# still ahead of now, which only the current and later months can have.
+# Slot starts are office wall-clock times, so `now` must be too
+# (availability.local_now()).
+
+ALL_KEY = 'all'
+UNDATED_KEY = 'undated'
+# Statuses where the student is expected to turn up; attendance and
+# no-show rates are computed over these
+EXPECTED_STATUSES = ('Approved', 'Completed')
+UNSPECIFIED = 'Unspecified'
+
+def counter_key(value):
+    """Field-name-safe form of a status or concern type ('.' and a leading '$' can't appear in keys)"""
+    key = str(value or UNSPECIFIED).replace('.', '_')
+    return '_' + key[1:] if key.startswith('$') else key
+
+def month_key(slot_start):
+    return slot_start.strftime('%Y-%m') if slot_start else UNDATED_KEY
+
+def slot_key(slot_start):
+    """Key of a slot within its month document; sorts in time order"""
+    return slot_start.strftime('%d %H:%M')
+
+def appointment_deltas(document, sign=1):
+    """$inc fields that add (sign=1) or remove (sign=-1) one stored appointment"""
+    status = counter_key(document.get('status') or 'Pending')
+    deltas = {
+        'total': sign,
+        f'status.{status}': sign,
+        f'concern_type.{counter_key(document.get("concern_type"))}': sign,
+    }
+    if document.get('attended'):
+        deltas[f'attended.{status}'] = sign
+    return deltas
+
+def change_deltas(before, after):
+    """$inc fields that move one appointment from its `before` to its `after` state"""
+    deltas = appointment_deltas(before, -1)
+    for field, value in appointment_deltas(after).items():
+        deltas[field] = deltas.get(field, 0) + value
+    return {field: value for field, value in deltas.items() if value}
+
+def record(stats, changes):
+    """Apply (slot_start, deltas) pairs to the month documents and the total in one bulk write"""
+    by_key = defaultdict(lambda: defaultdict(int))
+    for slot_start, deltas in changes:
+        for key in (month_key(slot_start), ALL_KEY):
+            for field, value in deltas.items():
+                by_key[key][field] += value
+        expected = sum(deltas.get(f'status.{name}', 0) for name in EXPECTED_STATUSES)
+        if slot_start and expected:
+            by_key[month_key(slot_start)][f'expected_slots.{slot_key(slot_start)}'] += expected
+    operations = [
+        UpdateOne({'_id': key}, {'$inc': {field: value for field, value in deltas.items() if value}}, upsert=True)
+        for key, deltas in by_key.items() if any(deltas.values())
+    ]
+    if operations:
+        stats.bulk_write(operations, ordered=False)
+
+def parse_months(month_from, month_to):
+    """Validated inclusive YYYY-MM bounds; raises ValueError with a client-facing message"""
+    for value in (month_from, month_to):
+        if value is not None and not _is_month(value):
+            raise ValueError('from and to must be months in YYYY-MM format')
+    if month_from and month_to and month_from > month_to:
+        raise ValueError('from must not be after to')
+    return month_from, month_to
+
+def _is_month(value):
+    year, _, month = value.partition('-')
+    return len(year) == 4 and year.isdigit() and len(month) == 2 and month.isdigit() and 1 <= int(month) <= 12
+
+def _rate(part, whole):
+    return round(part / whole, 4) if whole else None
+
+def upcoming_expected(document, now):
+    """Approved/Completed bookings in a counter document whose slot starts after now"""
+    key, current = document['_id'], now.strftime('%Y-%m')
+    if key in (ALL_KEY, UNDATED_KEY) or key < current:
+        return 0
+    slots = document.get('expected_slots', {})
+    if key > current:
+        return sum(slots.values())
+    cutoff = slot_key(now)
+    return sum(count for slot, count in slots.items() if slot > cutoff)
+
+def summarize(document, upcoming=0):
+    """API form of a counter document: counts plus attendance and no-show rates.
+
+    `upcoming` bookings have not started yet and are left out of the rates.
+    """
+    document = document or {}
+    status = document.get('status', {})
+    attended = document.get('attended', {})
+    expected = sum(status.get(name, 0) for name in EXPECTED_STATUSES) - upcoming
+    attended_expected = sum(attended.get(name, 0) for name in EXPECTED_STATUSES)
+    return {
+        'total': document.get('total', 0),
+        'by_status': {name: count for name, count in status.items() if count},
+        'by_concern_type': {name: count for name, count in document.get('concern_type', {}).items() if count},
+        'attended': sum(attended.values()),
+        'expected': expected,
+        'upcoming': upcoming,
+        'attendance_rate': _rate(attended_expected, expected),
+        'no_show_rate': _rate(expected - attended_expected, expected),
+    }
+
+def read(stats, month_from=None, month_to=None, now=None):
+    """The running total, and the monthly documents in [month_from, month_to] when either is given"""
+    now = now or datetime.utcnow()
+    # Only this month and later ones can hold slots that haven't started
+    upcoming = {
+        document['_id']: upcoming_expected(document, now)
+        for document in stats.find({'_id': {'$gte': now.strftime('%Y-%m'), '$lte': '9999-12'}}, {'expected_slots': 1})
+    }
+    summary = summarize(stats.find_one({'_id': ALL_KEY}), sum(upcoming.values()))
+    if month_from is None and month_to is None:
+        return summary, None
+    bounds = {'$gte': month_from or '0000-01', '$lte': month_to or '9999-12'}
+    months = [
+        dict(month=document['_id'], **summarize(document, upcoming.get(document['_id'], 0)))
+        for document in stats.find({'_id': bounds}).sort('_id', 1)
+    ]
+    return summary, months
+
+def _group(dimension=None, match=None):
+    month = {'$ifNull': [{'$dateToString': {'format': '%Y-%m', 'date': '$slot_start'}}, UNDATED_KEY]}
+    key = {'month': month}
+    if dimension == 'slot_start':
+        key['value'] = {'$dateToString': {'format': '%d %H:%M', 'date': '$slot_start'}}
+    elif dimension:
+        key['value'] = {'$ifNull': [f'${dimension}', 'Pending' if dimension == 'status' else UNSPECIFIED]}
+    stages = [{'$match': match}] if match else []
+    return stages + [{'$group': {'_id': key, 'count': {'$sum': 1}}}]
+
+def count(appointments):
+    """Counter documents recomputed from appointments with one $facet aggregation, keyed by _id"""
+    pipeline = [{'$facet': {
+        'total': _group(),
+        'status': _group('status'),
+        'concern_type': _group('concern_type'),
+        'attended': _group('status', {'attended': True}),
+        'expected_slots': _group('slot_start', {'status': {'$in': list(EXPECTED_STATUSES)}, 'slot_start': {'$ne': None}}),
+    }}]
+    facets = next(appointments.aggregate(pipeline, allowDiskUse=True), {})
+    documents = {}
+    for facet, rows in facets.items():
+        for row in rows:
+            for key in (row['_id']['month'], ALL_KEY):
+                document = documents.setdefault(key, {'_id': key, 'total': 0, 'status': {}, 'concern_type': {}, 'attended': {}})
+                if facet == 'total':
+                    document['total'] += row['count']
+                elif facet == 'expected_slots':
+                    # Slot keys only mean something within their month
+                    if key != ALL_KEY:
+                        slots = document.setdefault(facet, {})
+                        slots[row['_id']['value']] = slots.get(row['_id']['value'], 0) + row['count']
+                else:
+                    value = counter_key(row['_id']['value'])
+                    document[facet][value] = document[facet].get(value, 0) + row['count']
+    return documents
+
+def _normalize(document):
+    document = document or {}
+    return {
+        'total': document.get('total', 0),
+        **{
+            field: {name: value for name, value in document.get(field, {}).items() if value}
+            for field in ('status', 'concern_type', 'attended', 'expected_slots')
+        }
+    }
+
+def verify(appointments, stats):
+    """{_id: {'stored': ..., 'counted': ...}} for every counter document that disagrees with a recount"""
+    counted = count(appointments)
+    stored = {document['_id']: document for document in stats.find()}
+    mismatches = {}
+    for key in set(counted) | set(stored):
+        expected, actual = _normalize(counted.get(key)), _normalize(stored.get(key))
+        if expected != actual:
+            mismatches[key] = {'stored': actual, 'counted': expected}
+    return mismatches
+
+def rebuild(appointments, stats):
+    """Replace every counter document with a recount; returns the number of documents written.
+
+    Writes made while it runs may be counted twice or not at all; run it
+    when the office is closed, or run verify() afterwards.
+    """
+    documents = count(appointments)
+    stats.delete_many({'_id': {'$nin': list(documents)}})
+    if documents:
+        stats.bulk_write([
+            ReplaceOne({'_id': key}, document, upsert=True)
+            for key, document in documents.items()
+        ], ordered=False)
+    logger.info("✅ Rebuilt appointment statistics: %s documents", len(documents))
+    return len(documents)
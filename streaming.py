@@ -0,0 +1,155 @@
+import threading
+import time
+from flask import Response, current_app, stream_with_context
+from models import Appointment
+from pagination import parse_date_range
+
+DEFAULT_STREAM_BATCH_SIZE = 500
+MAX_STREAM_BATCH_SIZE = 5000
+DEFAULT_SSE_HEARTBEAT_SECONDS = 15
+DEFAULT_SSE_MAX_DURATION = 300
+# Clients reconnect this long after the server ends a stream
+SSE_RETRY_MS = 2000
+# Open feeds per worker; each holds a worker thread, so keep most threads for the API
+DEFAULT_SSE_MAX_STREAMS = 4
+
+class FeedSlots:
+    """Counts open change feeds in this worker and refuses new ones beyond a limit"""
+
+    def __init__(self, limit=DEFAULT_SSE_MAX_STREAMS):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._open = 0
+
+    def acquire(self):
+        """Take a slot without waiting; False if every slot is in use"""
+        with self._lock:
+            if self._open >= self.limit:
+                return False
+            self._open += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._open = max(self._open - 1, 0)
+
+    def stats(self):
+        with self._lock:
+            return {'open': self._open, 'limit': self.limit}
+
+feed_slots = FeedSlots()
+
+def init_app(app):
+    """Read SSE_MAX_STREAMS from the app config"""
+    feed_slots.limit = max(1, int(app.config.get('SSE_MAX_STREAMS', DEFAULT_SSE_MAX_STREAMS)))
+
+def parse_stream_args(args):
+    """Read stream/batch_size from request args.
+
+    Returns (stream, batch_size). Raises ValueError with a client-facing
+    message when batch_size is invalid.
+    """
+    stream = args.get('stream', '').lower() in ('1', 'true', 'yes')
+    default_batch_size = current_app.config.get('STREAM_BATCH_SIZE', DEFAULT_STREAM_BATCH_SIZE)
+    batch_size = args.get('batch_size', default_batch_size)
+    try:
+        batch_size = int(batch_size)
+    except (TypeError, ValueError):
+        raise ValueError('batch_size must be an integer')
+    if batch_size < 1 or batch_size > MAX_STREAM_BATCH_SIZE:
+        raise ValueError(f'batch_size must be between 1 and {MAX_STREAM_BATCH_SIZE}')
+    return stream, batch_size
+
+def _generate_json_object(items, key, fields):
+    dumps = current_app.json.dumps
+    head = dumps(fields)[:-1]  # Reopen the object: drop the closing brace
+    separator = ', ' if fields else ''
+    yield f'{head}{separator}{dumps(key)}: ['
+
+    count = 0
+    for item in items:
+        yield (', ' if count else '') + dumps(item)
+        count += 1
+
+    yield f'], "count": {count}}}'
+
+def json_stream_response(items, key, **fields):
+    """Stream {**fields, key: [...items], "count": n} as the iterable is consumed.
+
+    Only one item is serialized at a time, so memory stays flat however many
+    rows the cursor returns. The count comes last because it is only known
+    once the cursor is exhausted.
+    """
+    return Response(
+        stream_with_context(_generate_json_object(items, key, fields)),
+        mimetype='application/json'
+    )
+
+def parse_appointment_filters(args):
+    """Read status/from/to filters (change feed, date-range listing) from request args.
+
+    Returns (statuses, date_from, date_to); statuses is a list or None and
+    the dates are YYYY-MM-DD strings or None. Raises ValueError with a
+    client-facing message when a filter is invalid.
+    """
+    statuses = [status.strip() for status in args.get('status', '').split(',') if status.strip()]
+    invalid = [status for status in statuses if not Appointment.is_valid_status(status)]
+    if invalid:
+        raise ValueError(f"Invalid status: {', '.join(invalid)}")
+    start, end = parse_date_range(args.get('from'), args.get('to'))
+    # Stored dates are compared as strings, so hand them back in canonical form
+    date_from, date_to = (value.strftime('%Y-%m-%d') if value else None for value in (start, end))
+    return statuses or None, date_from, date_to
+
+def sse_event(data, event=None, event_id=None):
+    """Format one Server-Sent Events message; data must not contain newlines"""
+    lines = []
+    if event_id:
+        lines.append(f'id: {event_id}')
+    if event:
+        lines.append(f'event: {event}')
+    lines.append(f'data: {data}')
+    return '\n'.join(lines) + '\n\n'
+
+def _generate_change_events(change_stream, serialize, reset, heartbeat_seconds, max_duration):
+    dumps = current_app.json.dumps
+    yield f'retry: {SSE_RETRY_MS}\n\n'
+    if reset:
+        yield sse_event(dumps({'message': 'Resume point expired; reload appointments'}), event='reset')
+
+    deadline = time.monotonic() + max_duration
+    last_sent = time.monotonic()
+    try:
+        while change_stream.alive and time.monotonic() < deadline:
+            change = change_stream.try_next()
+            if change is not None:
+                yield sse_event(dumps(serialize(change)), event=change['operationType'], event_id=change['_id']['_data'])
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= heartbeat_seconds:
+                # A comment keeps proxies from closing the idle connection; the bare id
+                # moves the client's Last-Event-ID forward without dispatching an event
+                token = change_stream.resume_token
+                yield ': heartbeat\n' + (f"id: {token['_data']}\n" if token else '') + '\n'
+                last_sent = time.monotonic()
+    finally:
+        change_stream.close()
+
+def change_feed_response(change_stream, serialize, reset=False, on_close=None):
+    """Stream change stream events as text/event-stream until the client leaves.
+
+    Streams end after SSE_MAX_DURATION seconds; EventSource clients then
+    reconnect with Last-Event-ID, which frees the worker thread periodically.
+    on_close runs when the server closes the response, even if streaming
+    never started.
+    """
+    heartbeat_seconds = current_app.config.get('SSE_HEARTBEAT_SECONDS', DEFAULT_SSE_HEARTBEAT_SECONDS)
+    max_duration = current_app.config.get('SSE_MAX_DURATION', DEFAULT_SSE_MAX_DURATION)
+    response = Response(
+        stream_with_context(_generate_change_events(change_stream, serialize, reset, heartbeat_seconds, max_duration)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    response.call_on_close(change_stream.close)
+    if on_close:
+        response.call_on_close(on_close)
+    return response
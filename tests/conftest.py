@@ -0,0 +1,80 @@
+"""Shared fixtures: an in-memory MongoDB (mongomock) behind database.mongo.
+
+Install the test dependencies with `pip install -r requirements-dev.txt`.
+"""
+import contextlib
+import os
+import sys
+from datetime import datetime
+import bson
+import pytest
+from bson.raw_bson import RawBSONDocument
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import availability
+import database
+import stats
+from models import Appointment
+
+class RawCursor:
+    """mongomock has no RawBSONDocument support; re-encode what it returns"""
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def sort(self, *args, **kwargs):
+        return RawCursor(self._cursor.sort(*args, **kwargs))
+
+    def limit(self, limit):
+        return RawCursor(self._cursor.limit(limit))
+
+    def __iter__(self):
+        return (RawBSONDocument(bson.encode(document)) for document in self._cursor)
+
+class RawCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return RawCursor(self._collection.find(*args, **kwargs))
+
+    def find_one(self, *args, **kwargs):
+        document = self._collection.find_one(*args, **kwargs)
+        return None if document is None else RawBSONDocument(bson.encode(document))
+
+@pytest.fixture
+def db(monkeypatch):
+    mongomock = pytest.importorskip('mongomock')
+    db = mongomock.MongoClient().db
+    monkeypatch.setattr(database.mongo, 'db', db, raising=False)
+    monkeypatch.setattr(database, 'causal_session', lambda: contextlib.nullcontext())
+    monkeypatch.setitem(database._schema_state, 'canonical_ids', True)
+    monkeypatch.setattr(database, 'raw_collection', lambda name: RawCollection(db[name]))
+    # pymongo 4.11+ passes sort= to bulk update builders, which mongomock doesn't accept
+    builder = mongomock.collection.BulkOperationBuilder
+    add_update = builder.add_update
+    monkeypatch.setattr(builder, 'add_update', lambda self, *args, sort=None, **kwargs: add_update(self, *args, **kwargs))
+    return db
+
+@pytest.fixture
+def book(db):
+    """Factory storing an appointment along with its occupancy and statistics counters"""
+    def book(date='2026-03-02', time='09:00', status='Approved', attended=False, **fields):
+        appointment = Appointment(database.ObjectId(), date, time, 'Academic', status=status, attended=attended, created_at=datetime(2026, 1, 1))
+        document = dict(appointment.to_dict(), **fields)
+        db.appointments.insert_one(document)
+        if availability.occupies_slot(document.get('status')):
+            availability.add_bookings(db.slot_occupancy, [appointment.slot_start])
+        stats.record(db.appointment_stats, [(appointment.slot_start, stats.appointment_deltas(document))])
+        return appointment
+    return book
+
+@pytest.fixture
+def client(db):
+    from flask import Flask
+    from json_provider import APIJSONProvider
+    from routes import init_routes
+    app = Flask(__name__)
+    app.json = APIJSONProvider(app)
+    init_routes(app)
+    return app.test_client()
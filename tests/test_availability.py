@@ -0,0 +1,115 @@
+"""Slot reservations and date-range validation against an in-memory MongoDB (mongomock)."""
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+import pytest
+from flask import Flask
+
+import availability
+import database
+
+# A Monday, on the default slot grid
+BOOKING = {'user_id': 'u1', 'date': '2030-03-04', 'preferred_time': '09:00', 'concern_type': 'Academic'}
+
+def test_reserve_refuses_a_full_slot(db):
+    slot_start = datetime(2026, 3, 2, 9, 0)
+
+    assert availability.reserve(db.slot_occupancy, slot_start) is True
+    # The day document exists but doesn't match the capacity filter, so the upsert collides on _id
+    assert availability.reserve(db.slot_occupancy, slot_start) is False
+    assert db.slot_occupancy.find_one({'_id': '2026-03-02'})['slots'] == {'09:00': 1}
+
+def test_second_booking_of_a_full_slot_gets_409(client, db):
+    first = client.post('/appointments', json=BOOKING)
+    second = client.post('/appointments', json=dict(BOOKING, user_id='u2'))
+
+    assert first.status_code == 201
+    assert second.status_code == 409
+    assert second.json['error'] == 'This time slot is fully booked'
+    assert db.appointments.count_documents({}) == 1
+    assert db.slot_occupancy.find_one({'_id': '2030-03-04'})['slots'] == {'09:00': 1}
+
+def test_slot_times_config_is_normalised(monkeypatch):
+    monkeypatch.setitem(availability._settings, 'slot_times', availability.DEFAULT_SLOT_TIMES)
+    app = Flask(__name__)
+    app.config['SLOT_TIMES'] = '10:00, 9:00, 2:30 PM'
+
+    availability.init_app(app)
+
+    assert availability._settings['slot_times'] == ('09:00', '10:00', '14:30')
+    assert availability.bookable_slot_start('2030-03-04', '9:00') == datetime(2030, 3, 4, 9, 0)
+
+def test_unreadable_slot_time_fails_at_startup(monkeypatch):
+    monkeypatch.setitem(availability._settings, 'slot_times', availability.DEFAULT_SLOT_TIMES)
+    app = Flask(__name__)
+    app.config['SLOT_TIMES'] = '09:00,Morning'
+
+    with pytest.raises(RuntimeError, match="'Morning'"):
+        availability.init_app(app)
+
+@pytest.fixture
+def manila_morning(monkeypatch):
+    """08:30 on Monday 2030-03-04 in the office (UTC+8), while UTC has only just reached 00:30"""
+    class FrozenDateTime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(2030, 3, 4, 0, 30, tzinfo=timezone.utc).astimezone(tz)
+    monkeypatch.setattr(availability, 'datetime', FrozenDateTime)
+    monkeypatch.setitem(availability._settings, 'timezone', ZoneInfo('Asia/Manila'))
+
+def test_slots_passed_in_the_office_time_zone_are_closed(client, manila_morning):
+    passed = client.post('/appointments', json=dict(BOOKING, preferred_time='08:00'))
+    upcoming = client.post('/appointments', json=BOOKING)
+
+    assert passed.status_code == 400
+    assert passed.json['error'] == 'That time slot has already passed'
+    assert upcoming.status_code == 201
+    slots = client.get('/availability?from=2030-03-04&to=2030-03-04').json['days'][0]['slots']
+    assert [(slot['time'], slot['available']) for slot in slots[:3]] == [('08:00', 0), ('09:00', 0), ('10:00', 1)]
+
+def test_upcoming_count_uses_the_office_time_zone(db, book, manila_morning):
+    book('2030-03-04', '08:00')
+    book('2030-03-04', '09:00')
+
+    summary, _ = database.appointment_statistics()
+
+    assert (summary['expected'], summary['upcoming']) == (1, 1)
+
+@pytest.mark.parametrize('status', ['Cancelled', 'foo', None])
+def test_new_appointments_are_pending_whatever_status_is_sent(client, db, status):
+    response = client.post('/appointments', json=dict(BOOKING, status=status))
+
+    assert response.status_code == 201
+    assert db.appointments.find_one()['status'] == 'Pending'
+    assert db.slot_occupancy.find_one({'_id': '2030-03-04'})['slots'] == {'09:00': 1}
+
+@pytest.mark.parametrize('date', ['2020-01-06', '2026-03-02'])
+def test_past_slots_cannot_be_booked(client, db, date):
+    response = client.post('/appointments', json=dict(BOOKING, date=date))
+
+    assert response.status_code == 400
+    assert response.json['error'] == 'That time slot has already passed'
+    assert db.appointments.count_documents({}) == 0
+
+def test_started_slots_are_listed_as_unavailable(db):
+    db.slot_occupancy.insert_one({'_id': '2026-03-02', 'slots': {'09:00': 1}})
+    day = datetime(2026, 3, 2)
+
+    slots = availability.availability(db.slot_occupancy, day, day, now=datetime(2026, 3, 2, 10, 30))[0]['slots']
+
+    by_time = {slot['time']: slot for slot in slots}
+    assert (by_time['09:00']['booked'], by_time['09:00']['available']) == (1, 0)
+    assert by_time['10:00']['available'] == 0
+    assert by_time['11:00']['available'] == 1
+
+@pytest.mark.parametrize('query, error', [
+    ('from=2026-03-02', 'from and to are required'),
+    ('from=2026-03-02&to=03/09/2026', 'to must be a date in YYYY-MM-DD format'),
+    ('from=2026-03-09&to=2026-03-02', 'from must not be after to'),
+    ('from=2026-01-01&to=2026-12-31', 'range must not exceed 92 days'),
+])
+@pytest.mark.parametrize('path', ['/availability', '/appointments'])
+def test_range_endpoints_reject_bad_dates_alike(client, path, query, error):
+    response = client.get(f'{path}?{query}')
+
+    assert response.status_code == 400
+    assert response.json['error'] == error
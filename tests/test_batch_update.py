@@ -0,0 +1,46 @@
+"""Batch status/attendance updates against an in-memory MongoDB (mongomock)."""
+import pytest
+
+import database
+import stats
+
+def test_duplicate_ids_only_apply_once(db, book):
+    appointment_id = str(book()._id)
+
+    results = database.batch_update_appointments([
+        {'id': appointment_id, 'status': 'Rejected'},
+        {'id': appointment_id, 'status': 'Rejected'},
+    ])
+
+    assert [item['success'] for item in results] == [True, False]
+    assert results[1]['error'] == "Appointment appears more than once in this batch"
+    assert db.slot_occupancy.find_one({'_id': '2026-03-02'})['slots']['09:00'] == 0
+    total = db.appointment_stats.find_one({'_id': stats.ALL_KEY})
+    assert total['status'] == {'Approved': 0, 'Rejected': 1}
+    assert stats.verify(db.appointments, db.appointment_stats) == {}
+
+def test_item_whose_write_did_not_match_fails(db, book, monkeypatch):
+    appointment_id = str(book()._id)
+    # Another admin rejects the appointment between the batch's read and its write
+    bulk_write = db.appointments.bulk_write
+    def racing_bulk_write(*args, **kwargs):
+        db.appointments.update_one({'_id': database.ObjectId(appointment_id)}, {'$set': {'status': 'Rejected'}})
+        return bulk_write(*args, **kwargs)
+    monkeypatch.setattr(db.appointments, 'bulk_write', racing_bulk_write)
+
+    results = database.batch_update_appointments([{'id': appointment_id, 'status': 'Rejected'}])
+
+    assert results[0]['success'] is False
+    # The batch did not make this change, so it must not release the place
+    assert db.slot_occupancy.find_one({'_id': '2026-03-02'})['slots']['09:00'] == 1
+
+@pytest.mark.parametrize('update', [{'$unset': {'status': ''}}, {'$set': {'status': None}}])
+def test_appointment_without_status_is_treated_as_pending(db, book, update):
+    appointment_id = str(book(status='Pending')._id)
+    db.appointments.update_one({}, update)
+
+    results = database.batch_update_appointments([{'id': appointment_id, 'status': 'Rejected'}])
+
+    assert results[0]['success'] is True
+    assert db.appointments.find_one()['status'] == 'Rejected'
+    assert db.slot_occupancy.find_one({'_id': '2026-03-02'})['slots']['09:00'] == 0
@@ -0,0 +1,35 @@
+"""Versioned listing cache."""
+from cache import VersionedCache
+
+def test_write_during_compute_is_not_cached():
+    cache = VersionedCache(ttl=60)
+    def compute_racing_a_write():
+        # Another request writes after this one has read the old data
+        cache.bump()
+        return 'stale'
+
+    assert cache.get_or_compute('page', compute_racing_a_write) == 'stale'
+    assert cache.get('page') == (False, None)
+    assert cache.get_or_compute('page', lambda: 'fresh') == 'fresh'
+    assert cache.get('page') == (True, 'fresh')
+
+def test_bump_drops_every_entry():
+    cache = VersionedCache(ttl=60)
+    cache.get_or_compute('a', lambda: 1)
+    cache.get_or_compute('b', lambda: 2)
+
+    cache.bump()
+
+    assert cache.get('a') == (False, None)
+    assert cache.stats()['entries'] == 0
+
+def test_least_recently_used_entry_is_evicted():
+    cache = VersionedCache(ttl=60, max_entries=2)
+    cache.get_or_compute('a', lambda: 1)
+    cache.get_or_compute('b', lambda: 2)
+    cache.get('a')
+
+    cache.get_or_compute('c', lambda: 3)
+
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, 1)
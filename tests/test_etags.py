@@ -0,0 +1,44 @@
+"""ETag / If-None-Match on per-user reads against an in-memory MongoDB (mongomock)."""
+from bson import ObjectId
+
+USER_ID = ObjectId()
+
+def store_appointments(db, count):
+    db.appointments.insert_many([
+        {'_id': ObjectId(), 'user_id': USER_ID, 'date': f'2030-03-{day:02d}', 'preferred_time': '09:00',
+         'concern_type': 'Academic', 'status': 'Pending', 'attended': False}
+        for day in range(1, count + 1)
+    ])
+
+def test_each_page_has_a_stable_etag_and_revalidates_with_304(client, db):
+    store_appointments(db, 3)
+    first = client.get(f'/appointments/{USER_ID}?limit=2')
+    after = first.json['next_cursor']
+    second = client.get(f'/appointments/{USER_ID}?limit=2&after={after}')
+
+    for path, page in ((f'/appointments/{USER_ID}?limit=2', first), (f'/appointments/{USER_ID}?limit=2&after={after}', second)):
+        assert page.status_code == 200
+        assert client.get(path).headers['ETag'] == page.headers['ETag']
+        revalidated = client.get(path, headers={'If-None-Match': page.headers['ETag']})
+        assert revalidated.status_code == 304
+        assert revalidated.headers['ETag'] == page.headers['ETag']
+        assert revalidated.data == b''
+    assert first.headers['ETag'] != second.headers['ETag']
+
+def test_a_write_changes_the_etag(client, db):
+    store_appointments(db, 1)
+    etag = client.get(f'/appointments/{USER_ID}').headers['ETag']
+
+    db.appointments.update_one({}, {'$set': {'status': 'Approved'}})
+    response = client.get(f'/appointments/{USER_ID}', headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_profile_revalidates_with_304(client, db):
+    db.users.insert_one({'_id': USER_ID, 'username': 'ana', 'id_number': '1001', 'password_hash': 'x'})
+    etag = client.get(f'/user/{USER_ID}').headers['ETag']
+
+    response = client.get(f'/user/{USER_ID}', headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
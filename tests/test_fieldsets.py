@@ -0,0 +1,42 @@
+"""Sparse fieldsets (?fields=) on read endpoints against an in-memory MongoDB (mongomock)."""
+from bson import ObjectId
+
+USER_ID = ObjectId()
+
+def test_user_profile_returns_only_the_requested_fields(client, db):
+    db.users.insert_one({'_id': USER_ID, 'username': 'ana', 'id_number': '1001', 'password_hash': 'x', 'role': 'user'})
+
+    response = client.get(f'/user/{USER_ID}?fields=username,role')
+
+    assert response.status_code == 200
+    assert response.json['user'] == {'username': 'ana', 'role': 'user'}
+
+def test_user_appointments_return_only_the_requested_fields(client, db):
+    db.appointments.insert_one({
+        '_id': ObjectId(), 'user_id': USER_ID, 'date': '2030-03-04', 'preferred_time': '09:00',
+        'concern_type': 'Academic', 'status': 'Approved', 'attended': False
+    })
+
+    response = client.get(f'/appointments/{USER_ID}?fields=status,date')
+
+    assert response.status_code == 200
+    assert response.json['appointments'] == [{'status': 'Approved', 'date': '2030-03-04'}]
+
+def test_all_appointments_return_only_the_requested_fields(client, db):
+    db.users.insert_one({'_id': USER_ID, 'username': 'ana', 'id_number': '1001', 'password_hash': 'x'})
+    db.appointments.insert_one({
+        '_id': ObjectId(), 'user_id': USER_ID, 'date': '2030-03-04', 'preferred_time': '09:00',
+        'concern_type': 'Academic', 'status': 'Approved', 'attended': False,
+        'user_info': {'username': 'ana', 'id_number': '1001'}
+    })
+
+    response = client.get('/all-appointments?fields=date,user_info')
+
+    assert response.status_code == 200
+    assert response.json['appointments'] == [{'date': '2030-03-04', 'user_info': {'username': 'ana', 'id_number': '1001'}}]
+
+def test_unknown_field_is_rejected(client, db):
+    response = client.get(f'/user/{USER_ID}?fields=password_hash')
+
+    assert response.status_code == 400
+    assert response.json['error'].startswith('Unknown fields: password_hash.')
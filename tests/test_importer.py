@@ -0,0 +1,80 @@
+"""Bulk imports (flask import-data) against an in-memory MongoDB (mongomock)."""
+import io
+import json
+import bcrypt
+import pytest
+
+import database
+import importer
+from passwords import hasher, verify_password
+
+@pytest.fixture
+def users(db, monkeypatch):
+    # The unique indexes are what turn a repeated id_number into a write error
+    assert database.ensure_indexes(force=True) == []
+    monkeypatch.setattr(hasher, 'rounds', 4)
+    return db.users
+
+def jsonl(*rows):
+    return io.StringIO('\n'.join(row if isinstance(row, str) else json.dumps(row) for row in rows) + '\n')
+
+def user(username, id_number, **fields):
+    return dict(username=username, id_number=id_number, birthdate='2000-01-01', **fields)
+
+def test_mixed_user_batch_reports_each_bad_row_in_order(users):
+    password_hash = bcrypt.hashpw(b'secret1', bcrypt.gensalt(4)).decode('utf-8')
+    stream = jsonl(
+        user('ana', '1001', password_hash=password_hash),
+        user('ben', '1002', password_hash='plaintext-secret'),
+        user('cal', '1003', password='secret3'),
+        user('dee', '1001', password='secret4'),
+        {'username': 'eve', 'id_number': '1005', 'password': 'secret5'},
+        '{not json',
+        user('fay', '1007', password='short'),
+    )
+
+    report = importer.import_records('users', stream, 'jsonl', chunk_size=10, workers=1)
+
+    assert (report['rows'], report['inserted'], report['failed']) == (7, 2, 5)
+    assert [error['row'] for error in report['errors']] == [2, 4, 5, 6, 7]
+    errors = {error['row']: error['error'] for error in report['errors']}
+    assert errors[2] == 'password_hash must be a bcrypt hash'
+    # mongomock's write errors carry no keyPattern, so the field can't be named here
+    assert errors[4].startswith('Duplicate ')
+    assert errors[5] == 'Missing fields: birthdate'
+    assert errors[7] == 'Password must be at least 6 characters long'
+    assert report['errors_truncated'] is False
+
+    stored = {document['username']: document for document in users.find()}
+    assert set(stored) == {'ana', 'cal'}
+    assert stored['ana']['password_hash'] == password_hash
+    assert verify_password('secret3', stored['cal']['password_hash'])
+
+def test_duplicate_key_write_error_names_the_field():
+    # As the server reports a unique index violation inside a BulkWriteError
+    write_error = {
+        'index': 3, 'code': 11000,
+        'errmsg': 'E11000 duplicate key error collection: tupt.users index: tupt_id_number_unique dup key: { id_number: "1001" }',
+        'keyPattern': {'id_number': 1}, 'keyValue': {'id_number': '1001'},
+    }
+
+    assert database.duplicate_key_field(write_error) == 'id_number'
+    assert database.duplicate_key_field({'errmsg': write_error['errmsg']}) == 'id_number'
+
+def test_appointments_for_unknown_users_are_rejected(users, db):
+    users.insert_one({'_id': database.ObjectId(), 'username': 'ana', 'id_number': '1001'})
+    user_id = str(users.find_one()['_id'])
+    stream = io.StringIO(
+        'user_id,date,preferred_time,concern_type,status\n'
+        f'{user_id},2026-03-02,09:00,Academic,Approved\n'
+        f'{database.ObjectId()},2026-03-02,10:00,Academic,\n'
+        f'{user_id},2026-03-03,09:00,Academic,Booked\n'
+    )
+
+    report = importer.import_records('appointments', stream, 'csv', workers=1)
+
+    assert (report['inserted'], report['failed']) == (1, 2)
+    assert [error['row'] for error in report['errors']] == [3, 4]
+    assert report['errors'][0]['error'].startswith('Unknown user_id')
+    assert report['errors'][1]['error'] == 'Invalid status: Booked'
+    assert db.slot_occupancy.find_one({'_id': '2026-03-02'})['slots'] == {'09:00': 1}
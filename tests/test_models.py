@@ -0,0 +1,13 @@
+"""Immutable model behaviour."""
+from datetime import datetime
+import pytest
+from bson import ObjectId
+
+from models import Appointment
+
+def test_replace_rejects_unknown_fields():
+    appointment = Appointment(ObjectId(), '2030-03-04', '09:00', 'Academic', created_at=datetime(2030, 1, 1))
+
+    with pytest.raises(TypeError, match='created_at, statsu'):
+        appointment.replace(created_at=datetime(2030, 1, 2), statsu='Approved')
+    assert appointment.replace(status='Approved').status == 'Approved'
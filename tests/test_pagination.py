@@ -0,0 +1,69 @@
+"""Keyset pagination cursors."""
+import base64
+import pytest
+from bson import ObjectId, json_util
+
+from pagination import decode_cursor, encode_cursor, keyset_filter, parse_page_args, sort_spec
+
+def token(values):
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode('utf-8')).decode('ascii')
+
+@pytest.mark.parametrize('_id', [ObjectId(), 'legacy-string-id'])
+def test_cursor_round_trip(_id):
+    document = {'date': '2026-03-02', 'preferred_time': None, '_id': _id}
+
+    values = decode_cursor(encode_cursor(document))
+
+    assert values == ['2026-03-02', None, _id]
+    assert type(values[2]) is type(_id)
+
+@pytest.mark.parametrize('values', [
+    [{'$gt': ''}, '09:00', str(ObjectId())],
+    ['2026-03-02', {'$ne': None}, str(ObjectId())],
+    ['2026-03-02', '09:00', {'$exists': True}],
+    ['2026-03-02', '09:00', None],
+    ['2026-03-02', '09:00', 7],
+    ['2026-03-02', ['09:00'], str(ObjectId())],
+    ['2026-03-02', '09:00'],
+    {'date': '2026-03-02'},
+])
+def test_cursor_with_unexpected_values_is_rejected(values):
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        decode_cursor(token(values))
+
+def test_garbage_cursor_is_rejected():
+    with pytest.raises(ValueError, match='Invalid cursor'):
+        parse_page_args({'after': 'not a cursor!'})
+
+def test_keyset_filter_starts_after_the_cursor():
+    _id = ObjectId()
+
+    _, _, after = parse_page_args({'after': encode_cursor({'date': '2026-03-02', 'preferred_time': '09:00', '_id': _id})})
+
+    assert keyset_filter(after) == {'$or': [
+        {'date': {'$gt': '2026-03-02'}},
+        {'date': '2026-03-02', 'preferred_time': {'$gt': '09:00'}},
+        {'date': '2026-03-02', 'preferred_time': '09:00', '_id': {'$gt': _id}},
+    ]}
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_pages_walk_past_null_sort_keys(db, descending):
+    rows = [
+        {'date': '2026-03-02', 'preferred_time': '09:00'},
+        {'date': '2026-03-02', 'preferred_time': None},
+        {'date': '2026-03-02'},
+        {'date': None, 'preferred_time': '10:00'},
+        {'date': '2026-03-03', 'preferred_time': '08:00'},
+    ]
+    db.appointments.insert_many([dict(row, _id=ObjectId()) for row in rows])
+    expected = [row['_id'] for row in db.appointments.find().sort(sort_spec(descending=descending))]
+
+    seen, query = [], {}
+    while True:
+        page = list(db.appointments.find(query).sort(sort_spec(descending=descending)).limit(1))
+        if not page:
+            break
+        seen.append(page[0]['_id'])
+        query = keyset_filter(decode_cursor(encode_cursor(page[0])), descending=descending)
+
+    assert seen == expected
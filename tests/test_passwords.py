@@ -0,0 +1,16 @@
+"""Password hash upgrades against an in-memory MongoDB (mongomock)."""
+from bson import ObjectId
+
+import database
+from models import User
+
+def test_rehash_matches_a_legacy_string_id(db, monkeypatch):
+    monkeypatch.setitem(database._schema_state, 'canonical_ids', False)
+    user_id = str(ObjectId())
+    db.users.insert_one({'_id': user_id, 'username': 'ana', 'password_hash': 'old'})
+    user = User.from_dict(db.users.find_one())
+
+    assert database.update_password_hash(user._id, 'old', 'new') is True
+    assert db.users.find_one({'_id': user_id})['password_hash'] == 'new'
+    # A hash that changed since it was read is left alone
+    assert database.update_password_hash(user._id, 'old', 'newer') is False
@@ -0,0 +1,43 @@
+"""Appointment statistics counters against an in-memory MongoDB (mongomock)."""
+from datetime import datetime
+
+import stats
+
+NOW = datetime(2026, 3, 10, 12, 0)
+
+def test_future_booking_changes_neither_rate(db, book):
+    book('2026-03-02', '09:00', attended=True)
+    book('2026-03-10', '09:00')
+    before, _ = stats.read(db.appointment_stats, now=NOW)
+
+    # Later today, later this month and next month: none has started yet
+    book('2026-03-10', '14:00')
+    book('2026-03-20', '09:00')
+    book('2026-04-01', '09:00')
+    summary, months = stats.read(db.appointment_stats, '2026-03', '2026-04', now=NOW)
+
+    assert (before['attendance_rate'], before['no_show_rate']) == (0.5, 0.5)
+    assert (summary['attendance_rate'], summary['no_show_rate']) == (0.5, 0.5)
+    assert (summary['expected'], summary['upcoming']) == (2, 3)
+    assert [(month['expected'], month['upcoming']) for month in months] == [(2, 2), (0, 1)]
+    assert months[1]['no_show_rate'] is None
+
+def test_booking_counts_once_its_slot_has_started(db, book):
+    book('2026-03-10', '14:00')
+    assert stats.read(db.appointment_stats, now=NOW)[0]['no_show_rate'] is None
+
+    summary, _ = stats.read(db.appointment_stats, now=datetime(2026, 3, 10, 14, 0))
+
+    assert summary['no_show_rate'] == 1.0
+
+def test_rejecting_an_upcoming_booking_releases_its_slot(db, book):
+    appointment = book('2026-03-20', '09:00').to_dict()
+    db.appointments.update_one({'_id': appointment['_id']}, {'$set': {'status': 'Rejected'}})
+    stats.record(db.appointment_stats, [
+        (appointment['slot_start'], stats.change_deltas(appointment, dict(appointment, status='Rejected')))
+    ])
+
+    summary, _ = stats.read(db.appointment_stats, now=NOW)
+
+    assert (summary['expected'], summary['upcoming']) == (0, 0)
+    assert stats.verify(db.appointments, db.appointment_stats) == {}
@@ -0,0 +1,40 @@
+"""Single-appointment status transitions against an in-memory MongoDB (mongomock)."""
+import pytest
+
+import database
+from models import AppointmentNotFound, InvalidStatusTransition
+
+def test_pending_cannot_jump_to_completed(db, book):
+    appointment_id = str(book(status='Pending')._id)
+
+    with pytest.raises(InvalidStatusTransition, match='Can only approve or reject pending appointments'):
+        database.update_appointment_status(appointment_id, 'Completed')
+
+    assert db.appointments.find_one()['status'] == 'Pending'
+
+@pytest.mark.parametrize('update', [{'$unset': {'status': ''}}, {'$set': {'status': None}}])
+def test_appointment_without_status_can_be_approved(db, book, update):
+    appointment_id = str(book(status='Pending')._id)
+    db.appointments.update_one({}, update)
+
+    appointment, message = database.update_appointment_status(appointment_id, 'Approved')
+
+    assert (appointment.status, message) == ('Approved', 'Status updated successfully')
+    assert db.appointments.find_one()['status'] == 'Approved'
+    assert db.slot_occupancy.find_one({'_id': '2026-03-02'})['slots']['09:00'] == 1
+
+def test_setting_the_current_status_changes_nothing(db, book):
+    appointment_id = str(book()._id)
+    counters = list(db.appointment_stats.find())
+
+    appointment, message = database.update_appointment_status(appointment_id, 'Approved')
+
+    assert (appointment.status, message) == ('Approved', 'Status was already set to the requested value')
+    assert list(db.appointment_stats.find()) == counters
+    assert db.slot_occupancy.find_one({'_id': '2026-03-02'})['slots']['09:00'] == 1
+
+def test_unknown_id_is_not_found(db, book):
+    book()
+
+    with pytest.raises(AppointmentNotFound):
+        database.update_appointment_status(str(database.ObjectId()), 'Approved')